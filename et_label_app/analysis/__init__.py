@@ -0,0 +1,26 @@
+# flake8: noqa
+
+from .fixation import FIXATION_DTYPE
+from .fixation import FixationDetector
+from .fixation import detect_fixations
+from .fixation import idt
+from .fixation import ivt
+
+from .replay import gaze_per_frame
+from .replay import draw_trail
+from .replay import render_replay
+
+from .heatmap import Heatmap
+from .heatmap import aggregate_heatmap
+from .heatmap import session_heatmap
+
+from .aoi import AOI_SUFFIX
+from .aoi import AoiMask
+from .aoi import AoiSet
+from .aoi import aoi_path
+from .aoi import load_aois
+
+from .summary import SUMMARY_FIELDS
+from .summary import analyze_sessions
+from .summary import analyze_session
+from .summary import write_summary
@@ -0,0 +1,157 @@
+"""Areas of interest: named polygons over a stimulus, in image pixels.
+
+The AOIs of a stimulus are kept next to it as ``<stem>.aoi.json``.
+Samples are assigned to them in bulk with an exact point-in-polygon test
+of the samples within each AOI's bounding box, or one at a time during a
+recording from ``AoiMask``, a raster of the AOIs where a lookup costs
+O(1). Where AOIs overlap, the one listed first wins.
+"""
+import json
+import os.path as osp
+
+import cv2
+import numpy as np
+
+from et_label_app.utils import geometry
+
+
+AOI_SUFFIX = ".aoi.json"
+
+
+def aoi_path(stimulus):
+    """File of the AOIs of ``stimulus``."""
+    return osp.splitext(stimulus)[0] + AOI_SUFFIX
+
+
+class AoiSet(object):
+    """Named polygons over a ``width`` x ``height`` image."""
+
+    def __init__(self, width, height, stimulus=None):
+        self.width = int(width)
+        self.height = int(height)
+        self.stimulus = stimulus
+        self.names = []
+        self.polygons = []  # (M, 2) arrays of vertices
+        self.bboxes = np.empty((0, 4))  # x0, y0, x1, y1
+
+    def __len__(self):
+        return len(self.names)
+
+    def add(self, name, points):
+        """Add the polygon through ``points``; returns its index."""
+        polygon = np.asarray(points, float).reshape(-1, 2)
+        if len(polygon) < 3:
+            raise ValueError("AOI {!r} needs 3 vertices or more".format(name))
+        self.names.append(str(name))
+        self.polygons.append(polygon)
+        self.bboxes = np.vstack([
+            self.bboxes, np.concatenate([polygon.min(0), polygon.max(0)])
+        ])
+        return len(self.names) - 1
+
+    def remove(self, index):
+        del self.names[index]
+        del self.polygons[index]
+        self.bboxes = np.delete(self.bboxes, index, axis=0)
+
+    def assign(self, points):
+        """Index of the AOI each of ``points`` (an (N, 2) array in image
+        pixels) falls in, -1 for none."""
+        points = np.asarray(points, float).reshape(-1, 2)
+        hits = np.full(len(points), -1, np.intp)
+        x, y = points[:, 0], points[:, 1]
+        for i, (polygon, (x0, y0, x1, y1)) in enumerate(
+            zip(self.polygons, self.bboxes)
+        ):
+            candidates = np.flatnonzero(
+                (hits < 0) & (x >= x0) & (x <= x1) & (y >= y0) & (y <= y1)
+            )
+            if len(candidates):
+                inside = geometry.inside_polygon(points[candidates], polygon)
+                hits[candidates[inside]] = i
+        return hits
+
+    def mask(self, cell=1):
+        """``AoiMask`` of cells of ``cell`` x ``cell`` image pixels."""
+        shape = (
+            max(-(-self.height // cell), 1), max(-(-self.width // cell), 1)
+        )
+        grid = np.zeros(shape, np.int16)
+        # later AOIs first, so the first listed is painted over the others;
+        # vertices in 1/16 cell, at the centres of the cells
+        for i in reversed(range(len(self))):
+            vertices = (self.polygons[i] / cell - 0.5) * 16
+            cv2.fillPoly(
+                grid, [np.round(vertices).astype(np.int32)], i + 1,
+                lineType=cv2.LINE_8, shift=4,
+            )
+        return AoiMask(grid, cell)
+
+    def to_dict(self):
+        return {
+            "stimulus": self.stimulus,
+            "image_width": self.width,
+            "image_height": self.height,
+            "aois": [
+                {"name": name, "points": polygon.tolist()}
+                for name, polygon in zip(self.names, self.polygons)
+            ],
+        }
+
+    def save(self, path):
+        with open(path, "w") as f:
+            json.dump(self.to_dict(), f, indent=2)
+
+    @classmethod
+    def load(cls, path):
+        with open(path) as f:
+            data = json.load(f)
+        aois = cls(
+            data["image_width"], data["image_height"], data.get("stimulus")
+        )
+        for aoi in data["aois"]:
+            aois.add(aoi["name"], aoi["points"])
+        return aois
+
+
+def load_aois(stimulus):
+    """The AOIs saved for ``stimulus``, or None."""
+    path = aoi_path(stimulus)
+    if not osp.exists(path):
+        return None
+    return AoiSet.load(path)
+
+
+class AoiMask(object):
+    """Raster of an ``AoiSet``: the index + 1 of the AOI covering each
+    cell, 0 for none. Edges are only as exact as the cells are small."""
+
+    __slots__ = ("grid", "cell")
+
+    def __init__(self, grid, cell):
+        self.grid = grid
+        self.cell = cell
+
+    def hit(self, x, y):
+        """Index of the AOI at image coordinates ``x``, ``y``, -1 for
+        none."""
+        row, col = y / self.cell, x / self.cell
+        if 0 <= row < self.grid.shape[0] and 0 <= col < self.grid.shape[1]:
+            return int(self.grid[int(row), int(col)]) - 1
+        return -1  # also for NaN
+
+    def assign(self, points):
+        """``hit`` of each of ``points``, an (N, 2) array."""
+        points = np.asarray(points, float).reshape(-1, 2)
+        hits = np.full(len(points), -1, np.intp)
+        with np.errstate(invalid="ignore"):
+            cols = points[:, 0] // self.cell
+            rows = points[:, 1] // self.cell
+            inside = np.flatnonzero(
+                (rows >= 0) & (rows < self.grid.shape[0])
+                & (cols >= 0) & (cols < self.grid.shape[1])
+            )
+        hits[inside] = self.grid[
+            rows[inside].astype(np.intp), cols[inside].astype(np.intp)
+        ] - 1
+        return hits
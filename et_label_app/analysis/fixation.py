@@ -0,0 +1,265 @@
+import numpy as np
+
+
+FIXATION_DTYPE = np.dtype([
+    ("start", "<f8"),  # timestamp of the first sample
+    ("end", "<f8"),  # timestamp of the last sample
+    ("duration", "<f8"),
+    ("x", "<f4"),  # centroid
+    ("y", "<f4"),
+    ("start_idx", "<i8"),  # sample range [start_idx, stop_idx)
+    ("stop_idx", "<i8"),
+])
+
+
+def _fixations(t, x, y, starts, stops, min_duration):
+    starts = np.asarray(starts, dtype=np.int64)
+    stops = np.asarray(stops, dtype=np.int64)
+    if len(starts):
+        duration = t[stops - 1] - t[starts]
+        keep = duration >= min_duration
+        starts, stops = starts[keep], stops[keep]
+
+    fixations = np.zeros(len(starts), dtype=FIXATION_DTYPE)
+    if not len(starts):
+        return fixations
+    # centroids from prefix sums; fixations never contain NaN samples
+    n = stops - starts
+    cx = np.concatenate([[0.0], np.cumsum(np.nan_to_num(x, nan=0.0))])
+    cy = np.concatenate([[0.0], np.cumsum(np.nan_to_num(y, nan=0.0))])
+    fixations["start"] = t[starts]
+    fixations["end"] = t[stops - 1]
+    fixations["duration"] = fixations["end"] - fixations["start"]
+    fixations["x"] = (cx[stops] - cx[starts]) / n
+    fixations["y"] = (cy[stops] - cy[starts]) / n
+    fixations["start_idx"] = starts
+    fixations["stop_idx"] = stops
+    return fixations
+
+
+def _ivt_runs(t, x, y, velocity_threshold):
+    if len(t) < 2:
+        return np.empty(0, np.int64), np.empty(0, np.int64)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        velocity = np.hypot(np.diff(x), np.diff(y)) / np.diff(t)
+    slow = velocity < velocity_threshold
+
+    # the velocity of a sample is the one from its predecessor, the first
+    # sample has none
+    is_fixation = np.zeros(len(t), dtype=np.int8)
+    is_fixation[1:] = slow
+    edges = np.diff(is_fixation, prepend=0, append=0)
+    return np.flatnonzero(edges == 1), np.flatnonzero(edges == -1)
+
+
+def ivt(t, x, y, velocity_threshold, min_duration=0.0):
+    """Velocity-threshold identification (I-VT).
+
+    Samples whose point-to-point velocity, in coordinate units per second,
+    is below ``velocity_threshold`` are fixation samples; consecutive runs
+    of them lasting at least ``min_duration`` seconds are fixations.
+    Everything else is saccade or lost tracking (NaN coordinates).
+    """
+    t, x, y = (np.asarray(a, dtype=np.float64) for a in (t, x, y))
+    starts, stops = _ivt_runs(t, x, y, velocity_threshold)
+    return _fixations(t, x, y, starts, stops, min_duration)
+
+
+def _sliding_max(a, w):
+    """Maximum of every window ``a[i:i + w]`` in O(n) (van Herk/Gil-Werman)."""
+    n = len(a)
+    m = -(-n // w) * w
+    padded = np.full(m, -np.inf)
+    padded[:n] = a
+    blocks = padded.reshape(-1, w)
+    prefix = np.maximum.accumulate(blocks, axis=1).ravel()
+    suffix = np.maximum.accumulate(blocks[:, ::-1], axis=1)[:, ::-1].ravel()
+    return np.maximum(suffix[:n - w + 1], prefix[w - 1:n])
+
+
+def _expand(x, y, start, stop, dispersion_threshold):
+    """First index from ``stop`` on that breaks the dispersion of the
+    window starting at ``start``."""
+    n = len(x)
+    size = 2 * (stop - start)
+    while True:
+        end = min(start + size, n)
+        xs, ys = x[start:end], y[start:end]
+        dispersion = (
+            np.maximum.accumulate(xs) - np.minimum.accumulate(xs)
+            + np.maximum.accumulate(ys) - np.minimum.accumulate(ys)
+        )
+        # NaN propagates through accumulate and also ends the fixation
+        broken = np.flatnonzero(
+            ~(dispersion[stop - start:] <= dispersion_threshold)
+        )
+        if len(broken):
+            return stop + broken[0]
+        if end == n:
+            return n
+        size *= 2
+
+
+def _idt_window(t, min_duration, sample_interval=None):
+    if sample_interval is None:
+        sample_interval = np.median(np.diff(t)) if len(t) > 1 else 0
+    if sample_interval <= 0:
+        return 2
+    # 0.1 s at 60 Hz is 6 intervals, not the 6.000000000000001 of floats
+    q = min_duration / sample_interval
+    return max(2, int(np.ceil(q - 1e-9)) + 1)
+
+
+def _idt_runs(t, x, y, dispersion_threshold, w):
+    n = len(t)
+    if n < w:
+        return np.empty(0, np.int64), np.empty(0, np.int64)
+    lost = np.isnan(x) | np.isnan(y)
+    hi_x = _sliding_max(np.where(lost, np.inf, x), w)
+    lo_x = -_sliding_max(np.where(lost, np.inf, -x), w)
+    hi_y = _sliding_max(np.where(lost, np.inf, y), w)
+    lo_y = -_sliding_max(np.where(lost, np.inf, -y), w)
+    candidates = np.flatnonzero(
+        (hi_x - lo_x) + (hi_y - lo_y) <= dispersion_threshold
+    )
+
+    starts, stops = [], []
+    i = 0
+    while True:
+        j = np.searchsorted(candidates, i)
+        if j == len(candidates):
+            break
+        start = candidates[j]
+        stop = _expand(x, y, start, start + w, dispersion_threshold)
+        starts.append(start)
+        stops.append(stop)
+        i = stop
+    return np.asarray(starts, np.int64), np.asarray(stops, np.int64)
+
+
+def idt(t, x, y, dispersion_threshold, min_duration=0.1, sample_interval=None):
+    """Dispersion-threshold identification (I-DT).
+
+    A fixation starts at the first window spanning ``min_duration`` seconds
+    whose dispersion, ``(max(x) - min(x)) + (max(y) - min(y))``, is at most
+    ``dispersion_threshold``, and grows until adding a sample would exceed
+    it. The window length in samples uses ``sample_interval``, the median
+    one by default. Window dispersions are computed for all samples at
+    once; the loop only runs once per fixation.
+    """
+    t, x, y = (np.asarray(a, dtype=np.float64) for a in (t, x, y))
+    w = _idt_window(t, min_duration, sample_interval)
+    starts, stops = _idt_runs(t, x, y, dispersion_threshold, w)
+    return _fixations(t, x, y, starts, stops, min_duration)
+
+
+class FixationDetector(object):
+    """Incremental fixation detection over a live sample stream.
+
+    ``update`` takes the newest samples and returns the fixations that
+    ended in them, with sample indices counted from the first sample ever
+    given; ``flush`` returns the one still open at the end of the stream.
+    Samples are only kept from the start of a fixation that may still be
+    going on, so each update costs O(new samples + open fixation).
+
+    Parameters are those of ``ivt`` or ``idt``. For ``idt`` the window
+    length is fixed, from the median interval as in ``idt``, once the
+    samples span ``min_duration`` unless ``sample_interval`` is given.
+    """
+
+    def __init__(self, method="ivt", min_duration=0.1, **params):
+        if method not in ("ivt", "idt"):
+            raise ValueError("unsupported fixation method: {}".format(method))
+        self.method = method
+        self.min_duration = min_duration
+        self.params = params
+        self._window = None  # I-DT window length in samples
+        self._t = self._x = self._y = np.empty(0)
+        self._offset = 0  # index of self._t[0] in the whole stream
+
+    def _runs(self):
+        if self.method == "ivt":
+            return _ivt_runs(self._t, self._x, self._y, **self.params)
+        if self._window is None:
+            sample_interval = self.params.get("sample_interval")
+            if sample_interval is None and (
+                len(self._t) < 2
+                or self._t[-1] - self._t[0] < self.min_duration
+            ):
+                # no fixation can end before then
+                return np.empty(0, np.int64), np.empty(0, np.int64)
+            self._window = _idt_window(
+                self._t, self.min_duration, sample_interval
+            )
+        return _idt_runs(
+            self._t, self._x, self._y,
+            self.params["dispersion_threshold"], self._window,
+        )
+
+    def _take(self, starts, stops, keep):
+        fixations = _fixations(
+            self._t, self._x, self._y, starts, stops, self.min_duration
+        )
+        fixations["start_idx"] += self._offset
+        fixations["stop_idx"] += self._offset
+        self._t, self._x, self._y = (
+            a[keep:] for a in (self._t, self._x, self._y)
+        )
+        self._offset += keep
+        return fixations
+
+    def update(self, t, x, y):
+        self._t = np.concatenate([self._t, t])
+        self._x = np.concatenate([self._x, x])
+        self._y = np.concatenate([self._y, y])
+        n = len(self._t)
+
+        starts, stops = self._runs()
+        ended = stops < n
+        if self.method == "ivt":
+            # a sample's velocity needs its predecessor
+            keep = n - 1
+            cut = [stops[ended][-1] - 1] if ended.any() else []
+        else:
+            # a window needs this many samples before a fixation is found;
+            # until its length is known, keep them all
+            keep = 0 if self._window is None else n - self._window + 1
+            cut = [stops[ended][-1]] if ended.any() else []
+        if not ended.all():
+            keep = starts[-1] - (self.method == "ivt")
+        keep = int(max(max([keep] + cut), 0))
+        return self._take(starts[ended], stops[ended], keep)
+
+    def flush(self):
+        """Return the fixation still open at the end of the stream, if any."""
+        n = len(self._t)
+        starts, stops = self._runs()
+        is_open = stops == n
+        return self._take(starts[is_open], stops[is_open], n)
+
+
+def detect_fixations(gaze, screen_size, method="ivt", min_duration=0.1,
+                     velocity_threshold=1000, dispersion_threshold=50):
+    """Fixations of a recorded ``GAZE_DTYPE`` array.
+
+    Detection runs on screen pixels, where the thresholds are set, like
+    the live one; centroids are then taken in image coordinates. The
+    arguments match the ``fixation`` config section.
+    """
+    t = np.asarray(gaze["timestamp"], np.float64)
+    sx = np.asarray(gaze["raw_x"], np.float64) * screen_size[0]
+    sy = np.asarray(gaze["raw_y"], np.float64) * screen_size[1]
+    if method == "ivt":
+        fixations = ivt(t, sx, sy, velocity_threshold, min_duration)
+    elif method == "idt":
+        fixations = idt(t, sx, sy, dispersion_threshold, min_duration)
+    else:
+        raise ValueError("unsupported fixation method: {}".format(method))
+
+    starts, stops = fixations["start_idx"], fixations["stop_idx"]
+    for field in ("x", "y"):
+        total = np.concatenate([[0.0], np.cumsum(
+            np.nan_to_num(np.asarray(gaze[field], np.float64), nan=0.0)
+        )])
+        fixations[field] = (total[stops] - total[starts]) / (stops - starts)
+    return fixations
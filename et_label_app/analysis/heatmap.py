@@ -0,0 +1,226 @@
+import concurrent.futures
+import functools
+import math
+import os
+
+import cv2
+import numpy as np
+
+
+class Heatmap(object):
+    """Gaze density over a ``width`` x ``height`` image.
+
+    Weights are summed on a float32 grid of ``cell`` x ``cell`` image
+    pixels; ``add`` costs O(samples added). ``density`` is the grid
+    blurred by a Gaussian of ``sigma`` image pixels. It is kept between
+    calls: since the blur is linear, only what was added since is
+    blurred, over the neighbourhood it can reach, unless that covers most
+    of the grid.
+    """
+
+    def __init__(self, width, height, cell=8, sigma=32.0):
+        self.width = int(width)
+        self.height = int(height)
+        self.cell = int(cell)
+        self.sigma = float(sigma)
+        shape = (
+            max(-(-self.height // self.cell), 1),
+            max(-(-self.width // self.cell), 1),
+        )
+        self.grid = np.zeros(shape, np.float32)
+        self.version = 0  # incremented by every change
+        self._density = np.zeros(shape, np.float32)
+        self._pending = []  # (flat cell indices, weights) not blurred yet
+        self._stale = False  # _density needs a full blur
+
+    @property
+    def radius(self):
+        """Cells the blur reaches, the half size of its kernel."""
+        return int(math.ceil(4 * self.sigma / self.cell))
+
+    @property
+    def total(self):
+        return float(self.grid.sum(dtype=np.float64))
+
+    def add(self, x, y, weights=None):
+        """Add samples at image coordinates ``x``, ``y``, of weight 1 or
+        ``weights``. Samples that are NaN or out of the image are skipped.
+        Returns how many were added."""
+        x = np.asarray(x, np.float64).ravel()
+        y = np.asarray(y, np.float64).ravel()
+        inside = (x >= 0) & (x < self.width) & (y >= 0) & (y < self.height)
+        if weights is None:
+            weights = np.ones(int(inside.sum()), np.float32)
+        else:
+            weights = np.broadcast_to(
+                np.asarray(weights, np.float32), x.shape
+            )[inside]
+        if not len(weights):
+            return 0
+        cols = (x[inside] // self.cell).astype(np.intp)
+        rows = (y[inside] // self.cell).astype(np.intp)
+        cells = rows * self.grid.shape[1] + cols
+        np.add.at(self.grid.ravel(), cells, weights)
+        if not self._stale:
+            self._pending.append((cells, weights))
+        self.version += 1
+        return len(weights)
+
+    def add_fixations(self, fixations):
+        """Add fixation centroids, weighted by their duration."""
+        return self.add(fixations["x"], fixations["y"], fixations["duration"])
+
+    def __iadd__(self, other):
+        self.grid += other.grid
+        self._invalidate()
+        return self
+
+    def clear(self):
+        self.grid[:] = 0
+        self._invalidate()
+
+    def normalize(self):
+        """Scale the weights to sum to 1."""
+        total = self.total
+        if total > 0:
+            self.grid /= total
+            self._invalidate()
+
+    def _invalidate(self):
+        self._pending = []
+        self._stale = True
+        self.version += 1
+
+    def _blur(self, src):
+        size = 2 * self.radius + 1
+        return cv2.GaussianBlur(
+            src, (size, size), self.sigma / self.cell,
+            borderType=cv2.BORDER_CONSTANT,
+        )
+
+    def density(self):
+        if self._pending and not self._stale:
+            cells = np.concatenate([c for c, _ in self._pending])
+            weights = np.concatenate([w for _, w in self._pending])
+            rows, cols = np.divmod(cells, self.grid.shape[1])
+            r = self.radius
+            r0, r1 = max(rows.min() - r, 0), rows.max() + r + 1
+            c0, c1 = max(cols.min() - r, 0), cols.max() + r + 1
+            r1, c1 = min(r1, self.grid.shape[0]), min(c1, self.grid.shape[1])
+            if (r1 - r0) * (c1 - c0) * 2 > self.grid.size:
+                self._stale = True
+            else:
+                # the blur of what was added, all zeros around it
+                delta = np.zeros((r1 - r0, c1 - c0), np.float32)
+                np.add.at(delta, (rows - r0, cols - c0), weights)
+                self._density[r0:r1, c0:c1] += self._blur(delta)
+        if self._stale:
+            self._density = self._blur(self.grid)
+            self._stale = False
+        self._pending = []
+        return self._density
+
+    def colorize(self, alpha=0.6, colormap=cv2.COLORMAP_JET):
+        """The density as a BGRA image of the grid's size, colored by
+        ``colormap`` and at most ``alpha`` opaque, with premultiplied
+        alpha; empty where there is no gaze."""
+        density = self.density()
+        top = density.max()
+        if top <= 0:
+            return np.zeros(density.shape + (4,), np.uint8)
+        level = cv2.convertScaleAbs(density, alpha=255.0 / top)
+        a = cv2.convertScaleAbs(level, alpha=alpha)
+        bgr = cv2.multiply(
+            cv2.applyColorMap(level, colormap), cv2.merge([a, a, a]),
+            scale=1 / 255.0,
+        )
+        return cv2.merge([bgr, a])
+
+    def blend(self, image, alpha=0.6, colormap=cv2.COLORMAP_JET):
+        """Draw the heatmap over a BGR ``image`` of the image's size."""
+        overlay = cv2.resize(
+            self.colorize(alpha, colormap),
+            (image.shape[1], image.shape[0]),
+            interpolation=cv2.INTER_LINEAR,
+        ).astype(np.float32)
+        a = overlay[..., 3:] / 255.0
+        return (image * (1 - a) + overlay[..., :3]).astype(np.uint8)
+
+    def save(self, path):
+        """Save the grid and its geometry as ``.npz``."""
+        np.savez_compressed(
+            path, grid=self.grid,
+            size=(self.width, self.height, self.cell), sigma=self.sigma,
+        )
+
+    @classmethod
+    def load(cls, path):
+        data = np.load(path)
+        width, height, cell = (int(v) for v in data["size"])
+        heatmap = cls(width, height, cell, float(data["sigma"]))
+        heatmap.grid[:] = data["grid"]
+        heatmap._invalidate()
+        return heatmap
+
+
+def session_heatmap(session_dir, cell=8, sigma=32.0, fixations=None,
+                    normalize=True):
+    """Heatmap of a recorded session over its stimulus.
+
+    Every sample counts, or with ``fixations``, a dict of ``FixationDetector``
+    parameters, each fixation weighted by its duration. With ``normalize``
+    the weights sum to 1, so that sessions of different lengths count
+    alike in an aggregate.
+    """
+    from et_label_app.analysis.fixation import detect_fixations
+    from et_label_app.gaze import load_gaze
+    from et_label_app.gaze import load_meta
+
+    meta = load_meta(session_dir)
+    gaze = load_gaze(session_dir)
+    heatmap = Heatmap(meta["image_width"], meta["image_height"], cell, sigma)
+    if fixations is None:
+        heatmap.add(gaze["x"], gaze["y"])
+    else:
+        heatmap.add_fixations(detect_fixations(
+            gaze, (meta["screen_width"], meta["screen_height"]),
+            **fixations
+        ))
+    if normalize:
+        heatmap.normalize()
+    return heatmap
+
+
+def aggregate_heatmap(sessions, cell=8, sigma=32.0, fixations=None,
+                      workers=None):
+    """Sum of the normalized heatmaps of ``sessions``, each participant
+    counting alike; sessions are read in ``workers`` processes, one per
+    CPU by default. They must share the stimulus size.
+    """
+    sessions = list(sessions)
+    workers = max(1, min(workers or os.cpu_count() or 1, len(sessions)))
+    compute = functools.partial(
+        session_heatmap, cell=cell, sigma=sigma, fixations=fixations
+    )
+    if workers == 1:
+        heatmaps = map(compute, sessions)
+        return _sum_heatmaps(sessions, heatmaps)
+    with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+        return _sum_heatmaps(sessions, executor.map(compute, sessions))
+
+
+def _sum_heatmaps(sessions, heatmaps):
+    total = None
+    for session, heatmap in zip(sessions, heatmaps):
+        if total is None:
+            total = heatmap
+        elif heatmap.grid.shape != total.grid.shape:
+            raise ValueError(
+                "{} is {}x{}, the sessions before it {}x{}".format(
+                    session, heatmap.width, heatmap.height,
+                    total.width, total.height,
+                )
+            )
+        else:
+            total += heatmap
+    return total
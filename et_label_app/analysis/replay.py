@@ -0,0 +1,174 @@
+import concurrent.futures
+import os
+import os.path as osp
+import shutil
+import subprocess
+import tempfile
+
+import cv2
+import numpy as np
+
+from et_label_app.utils.video import VideoIndex
+
+
+# same look as widgets.canvas.Shape: half transparent green line and
+# opaque green round vertices
+LINE_COLOR = (0, 255, 0)  # BGR
+LINE_ALPHA = 0.5
+LINE_WIDTH = 2
+POINT_SIZE = 8
+
+
+def gaze_per_frame(gaze, frame_count):
+    """Return the last valid gaze point recorded on each video frame.
+
+    ``gaze`` is a recorded ``GAZE_DTYPE`` array; the result is a
+    (frame_count, 2) array of image coordinates, NaN where no sample
+    was recorded while that frame was shown.
+    """
+    valid = gaze[
+        (gaze["frame_idx"] >= 0)
+        & ~np.isnan(gaze["x"])
+        & ~np.isnan(gaze["y"])
+    ]
+    order = np.argsort(valid["frame_idx"], kind="stable")
+    frame_idx = valid["frame_idx"][order]
+    frames = np.arange(frame_count)
+    last = np.searchsorted(frame_idx, frames, side="right") - 1
+    hit = last >= 0
+    hit[hit] = frame_idx[last[hit]] == frames[hit]
+
+    points = np.full((frame_count, 2), np.nan, dtype=np.float32)
+    points[hit, 0] = valid["x"][order][last[hit]]
+    points[hit, 1] = valid["y"][order][last[hit]]
+    return points
+
+
+def draw_trail(frame, trail):
+    """Draw the (N, 2) ``trail`` of gaze points onto a BGR ``frame``."""
+    trail = trail[~np.isnan(trail).any(axis=1)]
+    if not len(trail):
+        return frame
+    points = np.round(trail).astype(np.int32)
+
+    # blend the line only inside its bounding box
+    h, w = frame.shape[:2]
+    pad = LINE_WIDTH + 1
+    x0, y0 = np.maximum(points.min(axis=0) - pad, 0)
+    x1, y1 = np.minimum(points.max(axis=0) + pad + 1, (w, h))
+    if x0 < x1 and y0 < y1:
+        roi = frame[y0:y1, x0:x1]
+        overlay = roi.copy()
+        cv2.polylines(
+            overlay, [points - (x0, y0)], False, LINE_COLOR, LINE_WIDTH,
+            cv2.LINE_AA,
+        )
+        cv2.addWeighted(overlay, LINE_ALPHA, roi, 1 - LINE_ALPHA, 0, roi)
+
+    for x, y in points:
+        cv2.circle(
+            frame, (int(x), int(y)), POINT_SIZE // 2, LINE_COLOR, -1,
+            cv2.LINE_AA,
+        )
+    return frame
+
+
+def _render_range(video_path, output, start, stop, points, trail, fps):
+    """Render frames [start, stop) of the video; ``points`` starts at
+    ``start - trail + 1``."""
+    cap = cv2.VideoCapture(video_path)
+    cap.set(cv2.CAP_PROP_POS_FRAMES, start)
+    size = (
+        int(cap.get(cv2.CAP_PROP_FRAME_WIDTH)),
+        int(cap.get(cv2.CAP_PROP_FRAME_HEIGHT)),
+    )
+    writer = cv2.VideoWriter(
+        output, cv2.VideoWriter_fourcc(*"mp4v"), fps, size
+    )
+    offset = start - trail + 1
+    frame = None
+    for frame_idx in range(start, stop):
+        ret, frame = cap.read(image=frame)
+        if not ret:
+            break
+        i = frame_idx - offset
+        draw_trail(frame, points[max(i - trail + 1, 0):i + 1])
+        writer.write(frame)
+    writer.release()
+    cap.release()
+    return output
+
+
+def _concat(parts, output, fps):
+    ffmpeg = shutil.which("ffmpeg")
+    if ffmpeg is not None:
+        list_file = osp.join(osp.dirname(parts[0]), "parts.txt")
+        with open(list_file, "w") as f:
+            for part in parts:
+                f.write("file '{}'\n".format(part))
+        subprocess.check_call([
+            ffmpeg, "-y", "-loglevel", "error", "-f", "concat",
+            "-safe", "0", "-i", list_file, "-c", "copy", output,
+        ])
+        return
+
+    # no ffmpeg: re-encode the parts one after the other
+    writer = None
+    for part in parts:
+        cap = cv2.VideoCapture(part)
+        frame = None
+        while True:
+            ret, frame = cap.read(image=frame)
+            if not ret:
+                break
+            if writer is None:
+                writer = cv2.VideoWriter(
+                    output, cv2.VideoWriter_fourcc(*"mp4v"), fps,
+                    (frame.shape[1], frame.shape[0]),
+                )
+            writer.write(frame)
+        cap.release()
+    if writer is not None:
+        writer.release()
+
+
+def render_replay(video_path, gaze, output, trail=10, workers=None):
+    """Render ``gaze`` over every frame of ``video_path`` into ``output``.
+
+    Frame ranges are rendered by a process pool into temporary parts that
+    are joined with ffmpeg's concat demuxer (stream copy) when available.
+    """
+    index = VideoIndex.load(video_path)
+    frame_count = len(index)
+    points = gaze_per_frame(gaze, frame_count)
+    workers = workers or os.cpu_count() or 1
+    workers = max(1, min(workers, frame_count))
+    padded = np.concatenate([np.full((trail - 1, 2), np.nan), points])
+    if workers == 1:
+        _render_range(
+            video_path, output, 0, frame_count, padded, trail, index.fps
+        )
+        return output
+
+    bounds = np.linspace(0, frame_count, workers + 1).astype(int)
+    tmp_dir = tempfile.mkdtemp(prefix="et_label_app_replay_")
+    try:
+        with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+            futures = [
+                executor.submit(
+                    _render_range,
+                    video_path,
+                    osp.join(tmp_dir, "part_{:04d}.mp4".format(i)),
+                    start,
+                    stop,
+                    padded[start:stop + trail - 1],
+                    trail,
+                    index.fps,
+                )
+                for i, (start, stop) in enumerate(zip(bounds, bounds[1:]))
+            ]
+            parts = [future.result() for future in futures]
+        _concat(parts, output, index.fps)
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return output
@@ -0,0 +1,206 @@
+"""Measures of recorded sessions, one row per session and per stimulus,
+each followed by one per AOI of the stimulus.
+
+Sessions are read through memory maps and analysed in a process pool,
+one session per task, so the time a study takes shrinks about linearly
+with the number of CPUs.
+"""
+import collections
+import concurrent.futures
+import csv
+import functools
+import os
+
+import numpy as np
+
+from et_label_app.analysis.aoi import load_aois
+from et_label_app.analysis.fixation import detect_fixations
+from et_label_app.analysis.heatmap import Heatmap
+from et_label_app.analysis.heatmap import _sum_heatmaps
+from et_label_app.gaze.storage import load_gaze
+from et_label_app.gaze.storage import load_meta
+
+
+SUMMARY_FIELDS = (
+    "level",  # session / stimulus
+    "name",  # session folder, or stimulus for its summary
+    "stimulus",
+    "aoi",  # measures of the AOI only, or of the whole stimulus if empty
+    "sessions",  # for a stimulus, those averaged: the ones with samples
+    "samples",
+    "duration",  # seconds from the first sample to the last
+    "valid",  # fraction of samples with a gaze point
+    "on_image",  # fraction of samples on the image
+    "dwell",  # fraction of samples on the AOI
+    "fixations",
+    "fixation_rate",  # fixations per second
+    "mean_fixation",  # seconds
+    "fixation_time",  # fraction of the duration spent in fixations
+    "first_fixation",  # seconds from the first sample to the first fixation
+    "coverage",  # fraction of heatmap cells looked at
+)
+
+# averaged over the sessions of a stimulus that have samples
+_MEAN_FIELDS = SUMMARY_FIELDS[5:-1]
+
+
+def _coverage(heatmap):
+    return np.count_nonzero(heatmap.grid) / heatmap.grid.size
+
+
+def _fixation_measures(fixations, t0, duration):
+    with np.errstate(divide="ignore", invalid="ignore"):
+        return {
+            "fixations": len(fixations),
+            "fixation_rate": np.divide(len(fixations), duration),
+            "mean_fixation": (
+                fixations["duration"].mean() if len(fixations) else np.nan
+            ),
+            "fixation_time": np.divide(
+                fixations["duration"].sum(), duration
+            ),
+            "first_fixation": (
+                fixations["start"][0] - t0 if len(fixations) else np.nan
+            ),
+        }
+
+
+def analyze_session(session_dir, fixation=None, cell=8, sigma=32.0):
+    """Summary rows of a session, the first for the whole stimulus and
+    one per AOI of the stimulus after it, and its normalized heatmap.
+
+    ``fixation`` holds ``detect_fixations`` parameters, such as the
+    ``fixation`` config section.
+    """
+    meta = load_meta(session_dir)
+    gaze = load_gaze(session_dir)
+    stimulus = meta.get("stimulus") or ""
+    width, height = meta["image_width"], meta["image_height"]
+    t = np.asarray(gaze["timestamp"], np.float64)
+    points = np.column_stack([gaze["x"], gaze["y"]]).astype(np.float64)
+    n = len(t)
+    t0 = t[0] if n else 0.0
+    duration = float(t[-1] - t0) if n else 0.0
+
+    fixations = detect_fixations(
+        gaze, (meta["screen_width"], meta["screen_height"]),
+        **(fixation or {})
+    )
+    heatmap = Heatmap(width, height, cell, sigma)
+    on_image = heatmap.add(points[:, 0], points[:, 1])
+    coverage = _coverage(heatmap)
+    heatmap.normalize()
+
+    base = {
+        "name": session_dir,
+        "stimulus": stimulus,
+        "sessions": 1,
+        "samples": n,
+        "duration": duration,
+    }
+    with np.errstate(divide="ignore", invalid="ignore"):
+        row = dict(
+            base,
+            level="session",
+            aoi="",
+            valid=np.divide(np.count_nonzero(np.isfinite(gaze["raw_x"])), n),
+            on_image=np.divide(on_image, n),
+            coverage=coverage,
+            **_fixation_measures(fixations, t0, duration)
+        )
+    rows = [row]
+
+    aois = load_aois(stimulus) if stimulus else None
+    if aois is not None:
+        sample_aoi = aois.assign(points)
+        fixation_aoi = aois.assign(
+            np.column_stack([fixations["x"], fixations["y"]])
+        )
+        for i, name in enumerate(aois.names):
+            with np.errstate(divide="ignore", invalid="ignore"):
+                dwell = np.divide(np.count_nonzero(sample_aoi == i), n)
+            rows.append(dict(
+                base,
+                level="session",
+                aoi=name,
+                dwell=dwell,
+                **_fixation_measures(
+                    fixations[fixation_aoi == i], t0, duration
+                )
+            ))
+    return rows, heatmap
+
+
+def analyze_sessions(sessions, fixation=None, cell=8, sigma=32.0,
+                     workers=None):
+    """Summary rows of ``sessions``, followed by one per stimulus, and the
+    aggregate heatmap of each stimulus, where every session counts alike.
+
+    A stimulus row averages the measures of its sessions that have
+    samples; an empty session, whose rates and fractions are undefined,
+    only gets its own rows, so that no mean counts it as zero.
+
+    Sessions are analysed in ``workers`` processes, one per CPU by
+    default.
+    """
+    sessions = list(sessions)
+    workers = max(1, min(workers or os.cpu_count() or 1, len(sessions)))
+    compute = functools.partial(
+        analyze_session, fixation=fixation, cell=cell, sigma=sigma
+    )
+    if workers == 1:
+        results = list(map(compute, sessions))
+    else:
+        with concurrent.futures.ProcessPoolExecutor(workers) as executor:
+            results = list(executor.map(compute, sessions))
+
+    rows = []
+    groups = collections.OrderedDict()  # (stimulus, aoi): rows
+    sessions_of = collections.OrderedDict()  # stimulus: (names, heatmaps)
+    for session_rows, heatmap in results:
+        rows += session_rows
+        for row in session_rows:
+            groups.setdefault((row["stimulus"], row["aoi"]), []).append(row)
+        names, heatmaps = sessions_of.setdefault(
+            session_rows[0]["stimulus"], ([], [])
+        )
+        names.append(session_rows[0]["name"])
+        heatmaps.append(heatmap)
+
+    heatmaps = collections.OrderedDict(
+        (stimulus, _sum_heatmaps(*sessions_of[stimulus]))
+        for stimulus in sessions_of
+    )
+    for (stimulus, aoi), group in groups.items():
+        group = [row for row in group if row["samples"]]
+        summary = {
+            "level": "stimulus",
+            "name": stimulus,
+            "stimulus": stimulus,
+            "aoi": aoi,
+            "sessions": len(group),
+        }
+        if not aoi:
+            summary["coverage"] = _coverage(heatmaps[stimulus])
+        for field in _MEAN_FIELDS:
+            if not group or field not in group[0]:
+                continue
+            values = np.array([row[field] for row in group], float)
+            summary[field] = (
+                np.nanmean(values) if np.isfinite(values).any() else np.nan
+            )
+        rows.append(summary)
+    return rows, heatmaps
+
+
+def write_summary(rows, path):
+    """Write summary rows as CSV."""
+    with open(path, "w", newline="") as f:
+        writer = csv.DictWriter(f, SUMMARY_FIELDS)
+        writer.writeheader()
+        for row in rows:
+            writer.writerow({
+                key: "{:.6g}".format(value) if isinstance(value, float)
+                else value
+                for key, value in row.items()
+            })
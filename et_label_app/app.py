@@ -1,6 +1,6 @@
 import functools
 import math
-import io
+import os
 import os.path as osp
 
 from qtpy import QtCore
@@ -8,12 +8,18 @@ from qtpy.QtCore import Qt
 from qtpy import QtGui
 from qtpy import QtWidgets
 
+import natsort
 import PIL.Image
 PIL.Image.MAX_IMAGE_PIXELS = None
 
 from et_label_app import __appname__
 
 from . import utils
+from et_label_app.analysis import AOI_SUFFIX
+from et_label_app.analysis import AoiSet
+from et_label_app.analysis import aoi_path
+from et_label_app.analysis import load_aois
+from et_label_app.gaze import session_name
 from et_label_app.config import get_config
 from et_label_app.widgets import FileDialogPreview
 from et_label_app.widgets import ToolBar
@@ -22,21 +28,10 @@ from et_label_app.widgets import Canvas
 
 
 def load_image_file(filename):
-    try:
-        image_pil = PIL.Image.open(filename)
-    except IOError:
+    image = utils.img_file_to_qimage(filename)
+    if image.isNull():
         print("Failed opening image file: {}".format(filename))
-        return
-
-    with io.BytesIO() as f:
-        ext = osp.splitext(filename)[1].lower()
-        if ext in [".jpg", ".jpeg"]:
-            format = "JPEG"
-        else:
-            format = "PNG"
-        image_pil.save(f, format=format)
-        f.seek(0)
-        return f.read()
+    return image
 
 
 class MainWindow(QtWidgets.QMainWindow):
@@ -54,7 +49,15 @@ class MainWindow(QtWidgets.QMainWindow):
         self.statusBar().show()
 
         # create canvas
-        self.canvas = Canvas()
+        self.canvas = Canvas(
+            gaze=self._config["gaze"],
+            video=self._config["video"],
+            fixation=self._config["fixation"],
+            recording=self._config["recording"],
+            render=self._config["render"],
+            heatmap=self._config["heatmap"],
+            aoi=self._config["aoi"],
+        )
 
         # set zoom
         self.zoomWidget = ZoomWidget()
@@ -98,6 +101,67 @@ class MainWindow(QtWidgets.QMainWindow):
             self.tr("Start recording"),
             enabled=False
         )
+        self.open_next_action = action(
+            self.tr("&Next"),
+            self.openNextFile,
+            shortcuts["open_next"],
+            None,
+            self.tr("Open next image or video in the folder"),
+            enabled=False
+        )
+        self.open_prev_action = action(
+            self.tr("&Prev"),
+            self.openPrevFile,
+            shortcuts["open_prev"],
+            None,
+            self.tr("Open previous image or video in the folder"),
+            enabled=False
+        )
+        self.hud_action = action(
+            self.tr("&HUD"),
+            self.toggleHud,
+            shortcuts["toggle_hud"],
+            None,
+            self.tr("Show paint and gaze latency statistics"),
+            checkable=True,
+        )
+        self.addAction(self.hud_action)
+        self.heatmap_action = action(
+            self.tr("Heat&map"),
+            self.toggleHeatmap,
+            shortcuts["toggle_heatmap"],
+            None,
+            self.tr("Show the gaze heatmap of the recording"),
+            checkable=True,
+            checked=self._config["heatmap"]["visible"],
+        )
+        self.addAction(self.heatmap_action)
+        self.aois_action = action(
+            self.tr("&AOIs"),
+            self.toggleAois,
+            shortcuts["toggle_aois"],
+            None,
+            self.tr("Show the areas of interest of the stimulus"),
+            checkable=True,
+            checked=self._config["aoi"]["visible"],
+        )
+        self.addAction(self.aois_action)
+        self.add_aoi_action = action(
+            self.tr("Add AO&I"),
+            self.addAoi,
+            shortcuts["add_aoi"],
+            None,
+            self.tr("Save the drawn fixations as an area of interest"),
+        )
+        self.addAction(self.add_aoi_action)
+        self.stop_rec_action = action(
+            self.tr("S&top"),
+            self.stop_rec,
+            None,
+            None,
+            self.tr("Stop recording"),
+            enabled=False
+        )
 
         # state
         self.image = QtGui.QImage()
@@ -107,6 +171,14 @@ class MainWindow(QtWidgets.QMainWindow):
             Qt.Vertical: {}
         }
         self.filename = None
+        self.playlist = None  # file list to step through instead of folder
+        self.playlist_index = None
+        cache = self._config["image_cache"]
+        self.image_cache = utils.ImageCache(
+            load_image_file,
+            max_bytes=cache["max_bytes"],
+            workers=cache["workers"],
+        )
 
         # setting
         self.settings = QtCore.QSettings("VNU", "et_label_app")
@@ -122,8 +194,11 @@ class MainWindow(QtWidgets.QMainWindow):
         self.tools = self.toolbar("Tools")
         utils.addActions(self.tools, (
             self.open_action,
+            self.open_prev_action,
+            self.open_next_action,
             None,
             self.start_rec_action,
+            self.stop_rec_action,
             None
         ))
 
@@ -138,6 +213,8 @@ class MainWindow(QtWidgets.QMainWindow):
 
     def setClean(self):
         self.start_rec_action.setEnabled(True)
+        self.open_next_action.setEnabled(True)
+        self.open_prev_action.setEnabled(True)
         title = __appname__
         if self.filename is not None:
             title = "{} - {}".format(title, self.filename)
@@ -148,6 +225,7 @@ class MainWindow(QtWidgets.QMainWindow):
 
     def resetState(self):
         self.filename = None
+        self.image = QtGui.QImage()
         self.canvas.resetState()
 
     def scrollRequest(self, delta, orientation):
@@ -220,13 +298,15 @@ class MainWindow(QtWidgets.QMainWindow):
 
         # load image / video data
         ext = osp.splitext(filename)[1].lower()
+        pyramid = None
         if ext in [".mp4"]:
-            image = utils.get_video_first_frame(filename)
-            self.canvas.load_video(filename)
+            image = self.canvas.load_video(filename)
+        elif self.isLargeImage(filename):
+            # shown from tiles, ``image`` is only a thumbnail
+            pyramid = utils.ImagePyramid.load(filename)
+            image = QtGui.QImage() if pyramid is None else pyramid.overview()
         else:
-            image = QtGui.QImage.fromData(
-                load_image_file(filename)
-            )
+            image = self.image_cache.get(filename)
 
         # check read ok
         if image.isNull():
@@ -241,7 +321,11 @@ class MainWindow(QtWidgets.QMainWindow):
             return False
 
         # load pixmap
-        self.canvas.loadPixmap(QtGui.QPixmap.fromImage(image))
+        if pyramid is not None:
+            self.canvas.loadPyramid(pyramid)
+        else:
+            self.canvas.loadPixmap(QtGui.QPixmap.fromImage(image))
+        self.canvas.setAois(load_aois(filename))
         self.canvas.setEnabled(True)
         self.setClean()
         self.image = image
@@ -267,8 +351,63 @@ class MainWindow(QtWidgets.QMainWindow):
         # status
         self.status(str(self.tr("Loaded %s")) % osp.basename(str(filename)))
 
+        self.prefetch()
         return True
 
+    def fileList(self):
+        """The playlist if there is one, otherwise the images and videos
+        of the current file's folder in natural order."""
+        if self.playlist is not None:
+            return self.playlist
+        if self.filename is None:
+            return []
+        extensions = tuple(
+            ".{}".format(fmt.data().decode())
+            for fmt in QtGui.QImageReader.supportedImageFormats()
+        ) + (".mp4",)
+        dirname = osp.dirname(self.filename)
+        return natsort.natsorted(
+            osp.join(dirname, f) for f in os.listdir(dirname)
+            if f.lower().endswith(extensions)
+        )
+
+    def fileIndex(self, files):
+        if self.playlist is not None:
+            return self.playlist_index
+        if self.filename in files:
+            return files.index(self.filename)
+        return None
+
+    def openNextFile(self, _value=False, step=1):
+        files = self.fileList()
+        i = self.fileIndex(files)
+        if i is None or not 0 <= i + step < len(files):
+            return
+        if self.playlist is not None:
+            self.playlist_index = i + step
+        self.loadFile(files[i + step])
+
+    def openPrevFile(self, _value=False):
+        self.openNextFile(step=-1)
+
+    def prefetch(self):
+        """Decode the images following the current one in the background."""
+        files = self.fileList()
+        i = self.fileIndex(files)
+        if i is None:
+            return
+        n = self._config["image_cache"]["prefetch"]
+        self.image_cache.prefetch([
+            f for f in files[i + 1:i + 1 + n]
+            if osp.splitext(f)[1].lower() not in [".mp4"]
+            and not self.isLargeImage(f)
+        ])
+
+    def isLargeImage(self, filename):
+        size = QtGui.QImageReader(filename).size()
+        limit = self._config["render"]["tile_pixels"]
+        return size.isValid() and size.width() * size.height() > limit
+
     def resizeEvent(self, event):
         if (
             self.canvas
@@ -295,16 +434,18 @@ class MainWindow(QtWidgets.QMainWindow):
         w1 = self.centralWidget().width() - e
         h1 = self.centralWidget().height() - e
         a1 = w1 / h1
-        w2 = self.canvas.pixmap.width() - 0.0
-        h2 = self.canvas.pixmap.height() - 0.0
+        w2 = self.canvas.imageSize().width() - 0.0
+        h2 = self.canvas.imageSize().height() - 0.0
         a2 = w2 / h2
         return w1 / w2 if a2 >= a1 else h1 / h2
 
     def scaleFitWidth(self):
         w = self.centralWidget().width() - 2.0
-        return w / self.canvas.pixmap.width()
+        return w / self.canvas.imageSize().width()
 
     def closeEvent(self, event):
+        self.canvas.stop_threads()
+        self.image_cache.shutdown()
         self.settings.setValue("window/size", self.size())
         self.settings.setValue("window/position", self.pos())
         self.settings.setValue("window/state", self.saveState())
@@ -316,7 +457,10 @@ class MainWindow(QtWidgets.QMainWindow):
             "*.{}".format(fmt.data().decode())
             for fmt in QtGui.QImageReader.supportedImageFormats()
         ] + ["*.mp4"]
-        filters = self.tr("Image & Video (%s)") % " ".join(self.formats)
+        filters = ";;".join([
+            self.tr("Image & Video (%s)") % " ".join(self.formats),
+            self.tr("Areas of interest (*%s)") % AOI_SUFFIX,
+        ])
         fileDialog = FileDialogPreview(self)
         fileDialog.setFileMode(FileDialogPreview.ExistingFile)
         fileDialog.setNameFilter(filters)
@@ -327,11 +471,72 @@ class MainWindow(QtWidgets.QMainWindow):
         fileDialog.setViewMode(FileDialogPreview.Detail)
         if fileDialog.exec_():
             fileName = fileDialog.selectedFiles()[0]
+            if fileName.endswith(AOI_SUFFIX):
+                # the stimulus, shown with its AOIs
+                fileName = AoiSet.load(fileName).stimulus or ""
             if fileName:
                 self.loadFile(fileName)
 
-    def start_rec(self, _value=False):
-        self.canvas.start_rec()
+    def toggleHud(self, value):
+        self.canvas.show_hud = value
+        self.canvas.update_hud(interval=0)
+        self.canvas.update()
+
+    def toggleHeatmap(self, value):
+        self.canvas.show_heatmap = value
+        self.canvas.update_heatmap(interval=0)
+        self.canvas.update()
+
+    def toggleAois(self, value):
+        self.canvas.show_aois = value
+        self.canvas.update()
+
+    def addAoi(self, _value=False):
+        """Save the hull of the drawn fixation vertices as an AOI of the
+        stimulus."""
+        if self.filename is None:
+            return
+        polygon = self.canvas.trailPolygon()
+        if polygon is None:
+            self.errorMessage(
+                self.tr("Cannot add an AOI"),
+                self.tr("At least three fixations must be drawn."),
+            )
+            return
+        aois = self.canvas.aois
+        if aois is None:
+            size = self.canvas.imageSize()
+            aois = AoiSet(size.width(), size.height(), self.filename)
+        name, ok = QtWidgets.QInputDialog.getText(
+            self, self.tr("Add AOI"), self.tr("Name:"),
+            text="aoi{}".format(len(aois) + 1),
+        )
+        if not ok or not name:
+            return
+        aois.add(name, polygon)
+        path = aoi_path(self.filename)
+        aois.save(path)
+        self.canvas.setAois(aois)
+        self.status(str(self.tr("Saved AOI %s to %s")) % (name, path))
+
+    def start_rec(self, _value=False, meta=None):
+        output_dir = self._config["recording"]["output_dir"]
+        if output_dir is None:
+            output_dir = osp.join(osp.dirname(self.filename), "recordings")
+        session_dir = osp.join(
+            osp.expanduser(output_dir), session_name(self.filename)
+        )
+        meta = dict(meta or {}, stimulus=self.filename)
+        self.canvas.start_rec(session_dir, meta)
+        self.start_rec_action.setEnabled(False)
+        self.stop_rec_action.setEnabled(True)
+        self.status(str(self.tr("Recording to %s")) % session_dir)
+
+    def stop_rec(self, _value=False):
+        self.canvas.stop_rec()
+        self.start_rec_action.setEnabled(True)
+        self.stop_rec_action.setEnabled(False)
+        self.status(str(self.tr("Recording stopped")))
 
     def errorMessage(self, title, message):
         return QtWidgets.QMessageBox.critical(
@@ -0,0 +1,483 @@
+"""Micro-benchmarks of the hot paths, run with ``et_label_app bench``."""
+import concurrent.futures
+import glob
+import io
+import json
+import multiprocessing
+import os.path as osp
+import shutil
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+from et_label_app.gaze.sources import synthetic_gaze
+
+
+here = osp.dirname(osp.abspath(__file__))
+
+
+def best_of(fn, repeat=5):
+    """Shortest wall time of ``repeat`` calls of ``fn``, in seconds."""
+    best = float("inf")
+    for _ in range(repeat):
+        t = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t)
+    return best
+
+
+def bench_fixation(n=1000000, chunk=10):
+    from et_label_app.analysis.fixation import FixationDetector
+    from et_label_app.analysis.fixation import idt
+    from et_label_app.analysis.fixation import ivt
+
+    t, x, y = synthetic_gaze(n)
+    results = []
+    for name, detect, params in (
+        ("ivt", ivt, {"velocity_threshold": 1000, "min_duration": 0.1}),
+        ("idt", idt, {"dispersion_threshold": 50, "min_duration": 0.1}),
+    ):
+        elapsed = best_of(lambda: detect(t, x, y, **params))
+        results.append(("fixation.{}".format(name), n / elapsed, "samples/s"))
+
+        # live use: chunks of `chunk` samples as GazeThread delivers them
+        def stream(t, x, y, chunk=chunk):
+            detector = FixationDetector(name, **params)
+            found = [
+                detector.update(
+                    t[i:i + chunk], x[i:i + chunk], y[i:i + chunk]
+                )
+                for i in range(0, len(t), chunk)
+            ]
+            return np.concatenate(found + [detector.flush()])
+
+        m = min(n, 100000)
+        elapsed = best_of(lambda: stream(t[:m], x[:m], y[:m]), repeat=1)
+        results.append((
+            "fixation.{}_stream".format(name), m / elapsed, "samples/s"
+        ))
+
+        # streaming must find what a batch run does, one sample at a time
+        # included, at the rates of common trackers too
+        for rate in (60, 120, 300, 1200):
+            sample = synthetic_gaze(min(n, 20000), rate=rate)
+            expected = detect(*sample, **params)
+            for step in (1, chunk):
+                found = stream(*sample, chunk=step)
+                if not np.array_equal(found, expected):
+                    raise AssertionError(
+                        "streaming {} at {} Hz in chunks of {} found {} "
+                        "fixations, batch {}".format(
+                            name, rate, step, len(found), len(expected)
+                        )
+                    )
+    return results
+
+
+def _load_roundtrip(filename):
+    """Image loading as it was done before ``img_file_to_qimage``: decode
+    with PIL, encode again and decode the result with Qt."""
+    import PIL.Image
+    from qtpy import QtGui
+
+    image_pil = PIL.Image.open(filename)
+    with io.BytesIO() as f:
+        ext = osp.splitext(filename)[1].lower()
+        image_pil.save(f, format="JPEG" if ext in [".jpg", ".jpeg"] else "PNG")
+        return QtGui.QImage.fromData(f.getvalue())
+
+
+def _load_direct(filename):
+    from et_label_app.app import load_image_file
+
+    return load_image_file(filename)
+
+
+def _peak_rss():
+    """High-water mark of this process' resident memory, in MiB."""
+    try:
+        # unlike ru_maxrss, not inherited from the parent across exec
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 2 ** 10
+    except IOError:
+        pass
+    import resource
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes on Linux, bytes on macOS
+    return peak / (2 ** 20 if sys.platform == "darwin" else 2 ** 10)
+
+
+def _peak_memory(loader, filename, warmup):
+    """Peak resident memory added by ``loader(filename)``, in MiB; run in
+    a fresh process. ``warmup``, a tiny image, gets the loader's modules
+    and plugins loaded first."""
+    loader(warmup)
+    before = _peak_rss()
+    loader(filename)
+    return _peak_rss() - before
+
+
+def bench_image_load(sizes=((4000, 3000), (8000, 6000))):
+    import cv2
+
+    tmp_dir = tempfile.mkdtemp()
+    warmup = osp.join(tmp_dir, "warmup.png")
+    cv2.imwrite(warmup, np.zeros((1, 1, 3), np.uint8))
+    images = sorted(glob.glob(osp.join(osp.dirname(here), "data", "*.jpg")))
+    for w, h in sizes:
+        # smooth content with some noise, compressing like a photograph
+        rng = np.random.default_rng(0)
+        small = rng.integers(0, 256, (h // 64, w // 64, 3), dtype=np.uint8)
+        image = cv2.resize(small, (w, h), interpolation=cv2.INTER_CUBIC)
+        image += rng.integers(0, 8, image.shape, dtype=np.uint8)
+        for ext in (".jpg", ".png"):
+            filename = osp.join(tmp_dir, "{}x{}{}".format(w, h, ext))
+            cv2.imwrite(filename, image)
+            images.append(filename)
+
+    # no resource module on Windows
+    measure_memory = sys.platform != "win32"
+    context = multiprocessing.get_context("spawn")
+    results = []
+    try:
+        for filename in images:
+            name = osp.basename(filename)
+            for loader in (_load_roundtrip, _load_direct):
+                label = "image_load.{}.{}".format(loader.__name__[6:], name)
+                elapsed = best_of(lambda: loader(filename), repeat=3)
+                results.append((label, elapsed * 1000, "ms"))
+                if not measure_memory:
+                    continue
+                with concurrent.futures.ProcessPoolExecutor(
+                    1, mp_context=context
+                ) as executor:
+                    peak = executor.submit(
+                        _peak_memory, loader, filename, warmup
+                    ).result()
+                results.append((label + ".peak", peak, "MiB"))
+    finally:
+        shutil.rmtree(tmp_dir)
+    return results
+
+
+_app = None
+
+
+def _qt_app():
+    """The QApplication, created on the offscreen platform unless another
+    one is asked for, so that benchmarks run without a display."""
+    global _app
+    import os
+
+    os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+    from qtpy import QtWidgets
+
+    if QtWidgets.QApplication.instance() is None:
+        _app = QtWidgets.QApplication([])
+    return QtWidgets.QApplication.instance()
+
+
+def _canvas(width=1920, height=1080):
+    """A shown Canvas on a noise image, reading gaze from nowhere."""
+    from qtpy import QtGui
+    from et_label_app.utils import img_npy_to_qimage
+    from et_label_app.widgets import Canvas
+
+    _qt_app()
+    canvas = Canvas(gaze={"source": "synthetic", "trace": False})
+    canvas.gaze_thread.stop()  # samples are fed by the benchmarks
+    rng = np.random.default_rng(0)
+    image = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+    # the pixmap may share the array's memory, give it its own copy
+    canvas.loadPixmap(
+        QtGui.QPixmap.fromImage(img_npy_to_qimage(image).copy())
+    )
+    canvas.resize(width, height)
+    canvas.show()
+    _qt_app().processEvents()  # until it is exposed, repaint() paints nothing
+    return canvas
+
+
+FRAME_SIZES = ((640, 480), (1280, 720), (1920, 1080), (3840, 2160))
+
+
+def bench_qimage(sizes=FRAME_SIZES):
+    from et_label_app.utils import img_npy_to_qimage
+
+    results = []
+    for w, h in sizes:
+        frame = np.random.default_rng(0).integers(
+            0, 256, (h, w, 3), dtype=np.uint8
+        )
+        out = np.empty((h, w, 4), np.uint8)
+        label = "qimage.{}x{}".format(w, h)
+        elapsed = best_of(lambda: img_npy_to_qimage(frame), repeat=50)
+        results.append((label, elapsed * 1e6, "us"))
+        # into a pooled buffer, as the video decoder does
+        elapsed = best_of(lambda: img_npy_to_qimage(frame, out), repeat=50)
+        results.append((label + ".pooled", elapsed * 1e6, "us"))
+    return results
+
+
+def bench_video(sizes=FRAME_SIZES[1:3], frames=120):
+    """Frames per second decoded and converted by the video thread's
+    decoder, the bound on playback speed."""
+    import cv2
+    from et_label_app.threads.video import FrameDecoder
+    from et_label_app.utils import VideoSession
+
+    _qt_app()
+    tmp_dir = tempfile.mkdtemp()
+    results = []
+    try:
+        for w, h in sizes:
+            filename = osp.join(tmp_dir, "{}x{}.mp4".format(w, h))
+            writer = cv2.VideoWriter(
+                filename, cv2.VideoWriter_fourcc(*"mp4v"), 30, (w, h)
+            )
+            rng = np.random.default_rng(0)
+            small = rng.integers(0, 256, (h // 32, w // 32, 3), np.uint8)
+            for i in range(frames):
+                frame = cv2.resize(np.roll(small, i, axis=1), (w, h))
+                writer.write(frame)
+            writer.release()
+
+            def decode():
+                decoder = FrameDecoder(VideoSession(filename))
+                decoder.start()
+                while True:
+                    ok, item = decoder.get(timeout=10)
+                    if not ok or item is None:
+                        break
+                    item.release()
+                decoder.stop()
+                decoder.session.release()
+
+            decode()  # builds the video index once
+            elapsed = best_of(decode, repeat=3)
+            results.append((
+                "video.decode.{}x{}".format(w, h), frames / elapsed, "frames/s"
+            ))
+    finally:
+        shutil.rmtree(tmp_dir)
+    return results
+
+
+def bench_paint(zooms=(0.5, 1.0, 2.0, 4.0), trails=(10, 100, 1000)):
+    """Full repaints of a 1920x1080 image with a trail of vertices."""
+    canvas = _canvas()
+    results = []
+    try:
+        for trail in trails:
+            _, x, y = synthetic_gaze(trail, rate=5, seed=trail)
+            canvas.current.clear()
+            for px, py in zip(np.nan_to_num(x), np.nan_to_num(y)):
+                canvas.current.append(px, py)
+            canvas.trail_length = trail
+            canvas.line.points = [canvas.lastPoint()] * 2
+            for zoom in zooms:
+                canvas.scale = zoom
+                canvas.repaint()  # scale the pixmap for this zoom once
+                elapsed = best_of(canvas.repaint, repeat=5)
+                results.append((
+                    "paint.zoom{:g}.trail{}".format(zoom, trail),
+                    elapsed * 1000,
+                    "ms",
+                ))
+    finally:
+        canvas.stop_threads()
+        canvas.close()
+    return results
+
+
+def bench_geometry(n=10000):
+    """Time per point of the Canvas geometry, one QPointF per call and
+    all points in one call of the ``utils.geometry`` kernel under it."""
+    from qtpy import QtCore
+    from et_label_app.utils import distancetoline
+    from et_label_app.utils import geometry
+
+    canvas = _canvas()
+    rng = np.random.default_rng(0)
+    inside = rng.uniform((0, 0), (1919, 1079), (n, 2))
+    # out of the image, in every direction
+    angle = rng.uniform(0, 2 * np.pi, n)
+    outside = np.column_stack([
+        960 + 2500 * np.cos(angle), 540 + 2500 * np.sin(angle)
+    ])
+    inside_points = [QtCore.QPointF(x, y) for x, y in inside]
+    outside_points = [QtCore.QPointF(x, y) for x, y in outside]
+    results = []
+    try:
+        def transform():
+            for p in outside_points:
+                canvas.transformPos(p)
+
+        def intersect():
+            for p1, p2 in zip(inside_points, outside_points):
+                canvas.intersectionPoint(p1, p2)
+
+        def distance():
+            for i in range(n - 1):
+                distancetoline(
+                    outside_points[i],
+                    (inside_points[i], inside_points[i + 1]),
+                )
+
+        for label, fn in (
+            ("geometry.transformPos", transform),
+            ("geometry.transformPoints",
+             lambda: canvas.transformPoints(outside)),
+            ("geometry.outOfPixmap",
+             lambda: [canvas.outOfPixmap(p) for p in outside_points]),
+            ("geometry.outOfPixmapMask",
+             lambda: canvas.outOfPixmapMask(outside)),
+            ("geometry.intersectionPoint", intersect),
+            ("geometry.intersectionPoints",
+             lambda: canvas.intersectionPoints(inside, outside)),
+            ("geometry.distancetoline", distance),
+            ("geometry.distance_to_segments",
+             lambda: geometry.distance_to_segments(
+                 outside[:-1], inside[:-1], inside[1:]
+             )),
+        ):
+            elapsed = best_of(fn, repeat=3)
+            results.append((label, elapsed / n * 1e9, "ns"))
+    finally:
+        canvas.stop_threads()
+        canvas.close()
+    return results
+
+
+def bench_aoi(n=1000000, count=8, vertices=12):
+    """Gaze samples assigned to ``count`` star-shaped AOIs per second, in
+    bulk by polygon and live from the raster, one sample per call."""
+    from et_label_app.analysis.aoi import AoiSet
+
+    rng = np.random.default_rng(0)
+    aois = AoiSet(1920, 1080)
+    angle = np.linspace(0, 2 * np.pi, vertices, endpoint=False)
+    radius = np.where(np.arange(vertices) % 2, 150.0, 60.0)
+    for i in range(count):
+        cx, cy = rng.uniform((150, 150), (1770, 930))
+        aois.add("aoi{}".format(i), np.column_stack([
+            cx + radius * np.cos(angle), cy + radius * np.sin(angle)
+        ]))
+    _, x, y = synthetic_gaze(n)
+    points = np.column_stack([x, y])
+    mask = aois.mask(2)
+    m = min(n, 100000)
+
+    def live():
+        for px, py in points[:m].tolist():
+            mask.hit(px, py)
+
+    return [
+        ("aoi.assign", n / best_of(lambda: aois.assign(points)), "samples/s"),
+        ("aoi.mask_assign", n / best_of(lambda: mask.assign(points)),
+         "samples/s"),
+        ("aoi.mask_hit", m / best_of(live, repeat=3), "samples/s"),
+    ]
+
+
+def bench_gaze(seconds=2.0, rate=1200, chunk=10):
+    """Samples per second the canvas takes in while recording, one chunk
+    per call as GazeThread emits them, and one sample per call."""
+    from qtpy import QtCore
+    from et_label_app.gaze.sources import SyntheticSource
+
+    canvas = _canvas()
+    tmp_dir = tempfile.mkdtemp()
+    results = []
+    try:
+        canvas.is_paint = True
+        canvas.start_rec(osp.join(tmp_dir, "session"))
+        n = int(seconds * rate)
+        source = SyntheticSource(rate=rate, seed=0)
+        times, points = source._more()
+        while len(times) < n:
+            more = source._more()
+            times = np.concatenate([times, more[0]])
+            points = np.concatenate([points, more[1]])
+        samples = np.column_stack([times[:n], points[:n]])
+        chunks = [samples[i:i + chunk] for i in range(0, n, chunk)]
+
+        def chunked():
+            for c in chunks:
+                canvas.read_gaze_chunk(c)
+                canvas.draw_frame()
+
+        elapsed = best_of(chunked, repeat=3)
+        results.append(("gaze.chunk", n / elapsed, "samples/s"))
+
+        size = canvas.screen_size
+        signals = [
+            (t, QtCore.QPoint(int(x * size[0]), int(y * size[1])), (x, y))
+            for t, x, y in np.nan_to_num(samples)
+        ]
+
+        def single():
+            for signal in signals:
+                canvas.read_gaze_signal(signal)
+                canvas.draw_frame()
+
+        elapsed = best_of(single, repeat=3)
+        results.append(("gaze.point", n / elapsed, "samples/s"))
+        canvas.stop_rec()
+    finally:
+        canvas.stop_threads()
+        canvas.close()
+        shutil.rmtree(tmp_dir)
+    return results
+
+
+def higher_is_better(unit):
+    return unit.endswith("/s")
+
+
+def save_baseline(path, results):
+    with open(path, "w") as f:
+        json.dump(
+            {label: {"value": value, "unit": unit}
+             for label, value, unit in results},
+            f, indent=2, sort_keys=True,
+        )
+
+
+def compare(results, path):
+    """Compare ``results`` to the baseline saved at ``path``.
+
+    Returns ``[(label, value, baseline, change), ...]`` for the results
+    the baseline has, ``change`` being the fraction by which the result
+    is worse (negative when better).
+    """
+    with open(path) as f:
+        baseline = json.load(f)
+    compared = []
+    for label, value, unit in results:
+        if label not in baseline or not baseline[label]["value"]:
+            continue
+        base = baseline[label]["value"]
+        if higher_is_better(unit):
+            change = base / value - 1 if value else float("inf")
+        else:
+            change = value / base - 1
+        compared.append((label, value, base, change))
+    return compared
+
+
+BENCHMARKS = {
+    "aoi": bench_aoi,
+    "fixation": bench_fixation,
+    "gaze": bench_gaze,
+    "geometry": bench_geometry,
+    "image_load": bench_image_load,
+    "paint": bench_paint,
+    "qimage": bench_qimage,
+    "video": bench_video,
+}
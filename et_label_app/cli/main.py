@@ -1,6 +1,12 @@
 import click
+import os.path as osp
 import sys
+import time
 
+import numpy as np
+
+from qtpy import QtCore
+from qtpy import QtGui
 from qtpy import QtWidgets
 
 from et_label_app import __appname__
@@ -32,6 +38,373 @@ def run():
     sys.exit(app.exec_())
 
 
+@root.command("experiment")
+@click.argument("playlist", type=click.Path(exists=True, dir_okay=False))
+def experiment(playlist):
+    """
+    Show and record the stimuli of PLAYLIST, a config file whose
+    "experiment" section lists them. Relative paths are resolved from the
+    playlist's folder; Escape aborts.
+    """
+    from et_label_app.experiment import ExperimentRunner
+
+    config = get_config(playlist)
+    if not config["experiment"]["stimuli"]:
+        raise click.BadParameter("no stimuli in {}".format(playlist))
+
+    app = QtWidgets.QApplication([])
+    app.setApplicationName(__appname__)
+    app.setWindowIcon(newIcon("icon"))
+    win = MainWindow(config=config)
+    runner = ExperimentRunner(
+        win, config["experiment"], base_dir=osp.dirname(playlist)
+    )
+    QtWidgets.QShortcut(QtGui.QKeySequence("Escape"), win, runner.stop)
+    runner.finished.connect(win.close)
+
+    if config["experiment"]["fullscreen"]:
+        win.showFullScreen()
+    else:
+        win.show()
+    win.raise_()
+    QtCore.QTimer.singleShot(0, runner.start)
+    status = app.exec_()
+
+    for trial in runner.log:
+        click.echo("{:>3} {:>+8.2f} ms  {}".format(
+            trial["trial"],
+            (trial["onset"] - trial["planned_onset"]) * 1000,
+            trial["file"],
+        ))
+    sys.exit(status)
+
+
+@root.command("simulate")
+@click.option(
+    "--rate", default=1200, show_default=True,
+    help="Samples per second of the synthetic gaze.",
+)
+@click.option(
+    "--replay", default=None, type=click.Path(exists=True, file_okay=False),
+    help="Play back the gaze of this recorded session instead.",
+)
+@click.option(
+    "--speed", default=1.0, show_default=True,
+    help="Playback speed of --replay.",
+)
+@click.option(
+    "--seed", default=None, type=int,
+    help="Seed of the synthetic gaze, random by default.",
+)
+@click.option(
+    "--duration", default=None, type=float,
+    help="Seconds to run, until Ctrl+C by default.",
+)
+@click.option(
+    "--stream", default="TobiiStreamEngine_gaze", show_default=True,
+    help="Name of the LSL stream.",
+)
+def simulate(rate, replay, speed, seed, duration, stream):
+    """
+    Stand in for the tracker: publish synthetic or recorded gaze as the LSL
+    stream the app reads.
+    """
+    from et_label_app.gaze.sources import ReplaySource
+    from et_label_app.gaze.sources import run_outlet
+    from et_label_app.gaze.sources import SyntheticSource
+
+    if replay is not None:
+        source = ReplaySource(replay, speed=speed)
+    else:
+        source = SyntheticSource(rate=rate, seed=seed)
+    click.echo("Publishing {} gaze as {}".format(source.name, stream))
+    t = time.time()
+    count = run_outlet(source, stream, rate=rate, duration=duration)
+    click.echo("Pushed {} samples in {:.1f}s".format(count, time.time() - t))
+
+
+@root.command("replay")
+@click.argument("video", type=click.Path(exists=True, dir_okay=False))
+@click.argument("session", type=click.Path(exists=True, file_okay=False))
+@click.option(
+    "-o", "--output", default=None,
+    help="Output video, <session>/replay.mp4 by default.",
+)
+@click.option(
+    "-j", "--workers", default=None, type=int,
+    help="Rendering processes, one per CPU by default.",
+)
+@click.option(
+    "--trail", default=10, show_default=True, type=click.IntRange(min=1),
+    help="Number of frames whose gaze point stays drawn.",
+)
+def replay(video, session, output, workers, trail):
+    """
+    Render a recorded gaze session over its video, without a window.
+    """
+    from et_label_app.analysis import render_replay
+    from et_label_app.gaze import load_frames
+    from et_label_app.gaze import load_gaze
+    from et_label_app.utils import frame_at
+
+    if output is None:
+        output = osp.join(session, "replay.mp4")
+    gaze = load_gaze(session)
+    frames = load_frames(session)
+    if frames is not None:
+        # join by time: the frame on screen when each sample was taken
+        times = frames["display"]
+        if np.isnan(times).all():
+            times = frames["present"]
+        gaze = np.array(gaze)
+        gaze["frame_idx"] = frame_at(gaze["timestamp"], times)
+    t = time.time()
+    render_replay(video, gaze, output, trail=trail, workers=workers)
+    click.echo("Wrote {} in {:.1f}s".format(output, time.time() - t))
+
+
+@root.command("heatmap")
+@click.argument(
+    "sessions", nargs=-1, required=True,
+    type=click.Path(exists=True, file_okay=False),
+)
+@click.option(
+    "-o", "--output", required=True, type=click.Path(dir_okay=False),
+    help="Output image; the grid is saved next to it as .npz.",
+)
+@click.option(
+    "--image", default=None, type=click.Path(exists=True, dir_okay=False),
+    help="Stimulus to draw the heatmap over, the recorded one by default.",
+)
+@click.option(
+    "--cell", default=8, show_default=True,
+    help="Image pixels per heatmap cell.",
+)
+@click.option(
+    "--sigma", default=32.0, show_default=True,
+    help="Blur, in image pixels.",
+)
+@click.option(
+    "--fixations", is_flag=True,
+    help="Weigh fixations by duration instead of counting samples.",
+)
+@click.option(
+    "-j", "--workers", default=None, type=int,
+    help="Processes reading the sessions, one per CPU by default.",
+)
+def heatmap(sessions, output, image, cell, sigma, fixations, workers):
+    """
+    Aggregate the gaze of recorded SESSIONS of one stimulus into a heatmap,
+    each session counting alike.
+    """
+    import cv2
+
+    from et_label_app.analysis import aggregate_heatmap
+    from et_label_app.gaze import load_meta
+
+    if image is None:
+        image = load_meta(sessions[0]).get("stimulus")
+    t = time.time()
+    try:
+        result = aggregate_heatmap(
+            sessions, cell=cell, sigma=sigma,
+            fixations={} if fixations else None, workers=workers,
+        )
+    except ValueError as e:
+        raise click.UsageError(str(e))
+    result.save(osp.splitext(output)[0] + ".npz")
+    picture = None
+    if image is not None and osp.exists(image):
+        picture = cv2.imread(image)  # None for a video
+    if picture is not None:
+        picture = cv2.resize(picture, (result.width, result.height))
+        cv2.imwrite(output, result.blend(picture))
+    else:
+        cv2.imwrite(output, result.colorize(alpha=1.0))
+    click.echo("Wrote {} from {} sessions in {:.1f}s".format(
+        output, len(sessions), time.time() - t
+    ))
+
+
+@root.command("analyze")
+@click.argument(
+    "paths", nargs=-1, required=True,
+    type=click.Path(exists=True, file_okay=False),
+)
+@click.option(
+    "-o", "--output", default="analysis.csv", show_default=True,
+    type=click.Path(dir_okay=False),
+    help="Table of the results, one row per session and per stimulus.",
+)
+@click.option(
+    "--heatmaps", default=None, type=click.Path(file_okay=False),
+    help="Also save the heatmap of each stimulus in this folder.",
+)
+@click.option(
+    "--cell", default=8, show_default=True,
+    help="Image pixels per heatmap cell.",
+)
+@click.option(
+    "--sigma", default=32.0, show_default=True,
+    help="Blur, in image pixels.",
+)
+@click.option(
+    "-j", "--workers", default=None, type=int,
+    help="Processes analysing sessions, one per CPU by default.",
+)
+def analyze(paths, output, heatmaps, cell, sigma, workers):
+    """
+    Analyse the recorded sessions in PATHS: fixations, as set in the
+    fixation config section, gaze measures and heatmaps, per session and
+    per stimulus, and for each AOI saved with the stimulus.
+    """
+    import os
+
+    import cv2
+
+    from et_label_app.analysis import analyze_sessions
+    from et_label_app.analysis import write_summary
+    from et_label_app.gaze import find_sessions
+
+    sessions = []
+    for path in paths:
+        sessions += [s for s in find_sessions(path) if s not in sessions]
+    if not sessions:
+        raise click.UsageError("no recorded sessions in {}".format(
+            ", ".join(paths)
+        ))
+    t = time.time()
+    try:
+        rows, stimulus_heatmaps = analyze_sessions(
+            sessions, fixation=get_config()["fixation"], cell=cell,
+            sigma=sigma, workers=workers,
+        )
+    except ValueError as e:
+        raise click.UsageError(str(e))
+    write_summary(rows, output)
+
+    # per stimulus, then its AOIs indented with the share of gaze on them
+    click.echo("{:<24} {:>8} {:>8} {:>9} {:>9} {:>8}".format(
+        "stimulus / aoi", "sessions", "gaze", "fix/s", "fix ms", "coverage"
+    ))
+    for row in rows:
+        if row["level"] != "stimulus":
+            continue
+        if row["aoi"]:
+            name = "  " + row["aoi"]
+            gaze, coverage = row["dwell"], ""
+        else:
+            name = osp.basename(row["stimulus"]) or "-"
+            gaze, coverage = row["valid"], "{:.1%}".format(row["coverage"])
+        click.echo("{:<24} {:>8} {:>8.1%} {:>9.2f} {:>9.0f} {:>8}".format(
+            name[:24], row["sessions"], gaze, row["fixation_rate"],
+            row["mean_fixation"] * 1000, coverage,
+        ))
+        if heatmaps is not None and not row["aoi"]:
+            if not osp.isdir(heatmaps):
+                os.makedirs(heatmaps)
+            stem = osp.join(heatmaps, osp.splitext(name)[0])
+            heatmap = stimulus_heatmaps[row["stimulus"]]
+            heatmap.save(stem + ".npz")
+            cv2.imwrite(stem + ".png", heatmap.colorize(alpha=1.0))
+    click.echo("Wrote {} from {} sessions in {:.1f}s".format(
+        output, len(sessions), time.time() - t
+    ))
+
+
+@root.command("latency")
+@click.argument(
+    "sessions", nargs=-1, required=True,
+    type=click.Path(exists=True, file_okay=False),
+)
+def latency(sessions):
+    """
+    Print gaze latency percentiles of recorded SESSIONS, per stage from
+    tracker sample to painted point.
+    """
+    from et_label_app.utils.trace import LATENCY_FILE
+    from et_label_app.utils import latency_stats
+
+    records = [
+        np.load(osp.join(session, LATENCY_FILE))
+        for session in sessions
+        if osp.exists(osp.join(session, LATENCY_FILE))
+    ]
+    if not records:
+        raise click.UsageError("no {} in the sessions".format(LATENCY_FILE))
+    click.echo("{:<10} {:>7}  {:^23}  {:^23}".format(
+        "stage", "chunks", "since sample p50/95/99", "since previous p50/95/99"
+    ))
+    for stage, count, since_sample, since_previous in latency_stats(
+        np.concatenate(records)
+    ):
+        if not count:
+            click.echo("{:<10} {:>7}".format(stage, 0))
+            continue
+        click.echo(
+            "{:<10} {:>7}  {:>7.2f} {:>7.2f} {:>7.2f}  "
+            "{:>7.2f} {:>7.2f} {:>7.2f}".format(
+                stage, count, *(since_sample + since_previous)
+            )
+        )
+
+
+@root.command("bench")
+@click.argument("names", nargs=-1)
+@click.option(
+    "--save", default=None, type=click.Path(dir_okay=False),
+    help="Save the results as a JSON baseline.",
+)
+@click.option(
+    "--compare", default=None, type=click.Path(exists=True, dir_okay=False),
+    help="Compare the results to a JSON baseline, failing on regressions.",
+)
+@click.option(
+    "--tolerance", default=0.5, show_default=True,
+    help="Fraction by which a result may be worse than the baseline.",
+)
+def bench(names, save, compare, tolerance):
+    """
+    Run micro-benchmarks (all of them, or only NAMES), on the offscreen Qt
+    platform unless QT_QPA_PLATFORM says otherwise.
+    """
+    from et_label_app import benchmark
+
+    for name in names:
+        if name not in benchmark.BENCHMARKS:
+            raise click.BadParameter(
+                "unknown benchmark {}, choose from {}".format(
+                    name, ", ".join(sorted(benchmark.BENCHMARKS))
+                )
+            )
+    results = []
+    for name in names or sorted(benchmark.BENCHMARKS):
+        for label, value, unit in benchmark.BENCHMARKS[name]():
+            click.echo("{:<32} {:>14,.1f} {}".format(label, value, unit))
+            results.append((label, value, unit))
+
+    if save is not None:
+        benchmark.save_baseline(save, results)
+        click.echo("Saved {} results to {}".format(len(results), save))
+    if compare is None:
+        return
+    regressions = 0
+    click.echo("\nCompared to {}:".format(compare))
+    for label, value, base, change in benchmark.compare(
+        results, compare
+    ):
+        regressed = change > tolerance
+        regressions += regressed
+        click.echo("{:<32} {:>14,.1f} {:>14,.1f} {:>+7.0%}{}".format(
+            label, value, base, -change, "  REGRESSION" if regressed else ""
+        ))
+    if regressions:
+        click.echo("{} regression(s) beyond {:.0%}".format(
+            regressions, tolerance
+        ))
+        sys.exit(1)
+
+
 def main():
     root()
 
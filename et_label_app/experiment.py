@@ -0,0 +1,154 @@
+import concurrent.futures
+import os.path as osp
+
+from qtpy import QtCore
+
+from et_label_app.utils import clock
+from et_label_app.utils import VideoIndex
+
+
+VIDEO_EXTENSIONS = [".mp4"]
+
+
+def is_video(filename):
+    return osp.splitext(filename)[1].lower() in VIDEO_EXTENSIONS
+
+
+class ExperimentRunner(QtCore.QObject):
+    """Run the playlist of the ``experiment`` config section in a
+    ``MainWindow``: each stimulus is shown and recorded for its duration,
+    followed by a blank gap.
+
+    Transitions follow an absolute ``clock.now()`` schedule, so
+    timer latency does not add up over trials. Each stimulus is loaded
+    into the blanked canvas at the start of the gap before it, so that its
+    onset only costs one repaint; the onset is taken right after that
+    repaint and saved with the recording as ``onset``, next to the
+    ``planned_onset``. Stimuli further ahead are decoded (images) or
+    indexed (videos) in the background.
+    """
+
+    finished = QtCore.Signal()
+
+    def __init__(self, window, experiment, base_dir="."):
+        super(ExperimentRunner, self).__init__(window)
+        self.window = window
+        self.trials = [
+            self._trial(item, experiment, base_dir)
+            for item in experiment["stimuli"]
+        ]
+        self.log = []  # one dict per trial shown
+        self.due = None  # clock.now() time of the next transition
+        self._callback = None
+        self._executor = concurrent.futures.ThreadPoolExecutor(1)
+        self._indexing = {}  # video: future of its VideoIndex
+        self.timer = QtCore.QTimer(self)
+        self.timer.setSingleShot(True)
+        self.timer.setTimerType(QtCore.Qt.PreciseTimer)
+        self.timer.timeout.connect(self._fire)
+
+    @staticmethod
+    def _trial(item, experiment, base_dir):
+        if not isinstance(item, dict):
+            item = {"file": item}
+        filename = osp.join(base_dir, osp.expanduser(item["file"]))
+        default = None if is_video(filename) else experiment["duration"]
+        return {
+            "file": osp.abspath(filename),
+            "duration": item.get("duration", default),  # None: whole video
+            "gap": item.get("gap", experiment["gap"]),
+        }
+
+    def start(self):
+        self.window.playlist = [trial["file"] for trial in self.trials]
+        self.window.playlist_index = 0
+        self.window.prefetch()
+        self._preload_videos(0)
+        if not self._prepare(0):
+            return
+        self.due = clock.now()
+        self._show(0)
+
+    def stop(self):
+        self.timer.stop()
+        self._callback = None
+        self.window.stop_rec()
+        self.window.canvas.blank = False
+        self._executor.shutdown(wait=False)
+        self.finished.emit()
+
+    def _at(self, due, callback):
+        self._callback = callback
+        delay = int(round((due - clock.now()) * 1000))
+        self.timer.start(max(delay, 0))
+
+    def _fire(self):
+        callback, self._callback = self._callback, None
+        if callback is not None:
+            callback()
+
+    def _preload_videos(self, i):
+        n = self.window._config["image_cache"]["prefetch"]
+        for trial in self.trials[i:i + n]:
+            if is_video(trial["file"]) and trial["file"] not in self._indexing:
+                self._indexing[trial["file"]] = self._executor.submit(
+                    VideoIndex.load, trial["file"]
+                )
+
+    def _prepare(self, i):
+        """Load stimulus ``i`` without showing it yet."""
+        canvas = self.window.canvas
+        canvas.blank = True
+        canvas.repaint()
+        self.window.playlist_index = i
+        future = self._indexing.pop(self.trials[i]["file"], None)
+        if future is not None:
+            # wait for the index rather than build it a second time
+            try:
+                future.result()
+            except Exception as e:
+                print("Failed to index {}: {}".format(
+                    self.trials[i]["file"], e
+                ))
+        if not self.window.loadFile(self.trials[i]["file"]):
+            self.stop()
+            return False
+        if canvas.pyramid is None:
+            canvas.scaledPixmap()  # resample for the current zoom now
+        return True
+
+    def _show(self, i):
+        trial = self.trials[i]
+        planned = self.due
+        self.window.canvas.blank = False
+        self.window.canvas.repaint()
+        onset = clock.now()
+        self.window.start_rec(meta={
+            "trial": i,
+            "planned_onset": planned,
+            "onset": onset,
+        })
+        self.log.append({
+            "trial": i,
+            "file": trial["file"],
+            "planned_onset": planned,
+            "onset": onset,
+            "session_dir": self.window.canvas.recorder.session_dir,
+        })
+        self._preload_videos(i + 1)
+
+        duration = trial["duration"]
+        if duration is None:
+            session = self.window.canvas.video_thresh.session
+            duration = session.frame_count / session.fps
+        self.due = planned + duration
+        self._at(self.due, lambda: self._end(i))
+
+    def _end(self, i):
+        self.window.stop_rec()
+        if i + 1 == len(self.trials):
+            self.stop()
+            return
+        self.due += self.trials[i]["gap"]
+        if self._prepare(i + 1):
+            self._at(self.due, lambda: self._show(i + 1))
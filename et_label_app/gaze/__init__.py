@@ -0,0 +1,24 @@
+# flake8: noqa
+
+from .buffer import RingBuffer
+
+from .storage import GAZE_DTYPE
+from .storage import FRAME_DTYPE
+from .storage import NpyAppender
+from .storage import open_array
+from .storage import session_name
+from .storage import write_meta
+from .storage import load_meta
+from .storage import find_sessions
+from .storage import load_gaze
+from .storage import write_frames
+from .storage import load_frames
+
+from .sources import GazeSource
+from .sources import LslSource
+from .sources import MouseSource
+from .sources import SyntheticSource
+from .sources import ReplaySource
+from .sources import create_source
+from .sources import run_outlet
+from .sources import synthetic_gaze
@@ -0,0 +1,70 @@
+import threading
+
+import numpy as np
+
+
+class RingBuffer(object):
+    """Fixed-capacity FIFO of structured records backed by one NumPy array.
+
+    Producers ``push`` batches (usually from the GUI thread) and a single
+    consumer ``drain``s them (usually a writer thread). Nothing is
+    allocated after construction. If the consumer falls more than
+    ``capacity`` records behind, the oldest records are overwritten and
+    counted in ``overflow``.
+    """
+
+    def __init__(self, capacity, dtype):
+        self.capacity = int(capacity)
+        self._data = np.zeros(self.capacity, dtype=dtype)
+        self._head = 0  # number of records ever pushed
+        self._tail = 0  # number of records ever drained
+        self._lock = threading.Lock()
+        self.overflow = 0
+
+    @property
+    def dtype(self):
+        return self._data.dtype
+
+    def __len__(self):
+        with self._lock:
+            return self._head - self._tail
+
+    def clear(self):
+        with self._lock:
+            self._head = self._tail = 0
+            self.overflow = 0
+
+    def push(self, records):
+        n = len(records)
+        if n == 0:
+            return
+        if n > self.capacity:
+            with self._lock:
+                self.overflow += n - self.capacity
+            records = records[-self.capacity:]
+            n = self.capacity
+
+        with self._lock:
+            start = self._head % self.capacity
+            first = min(n, self.capacity - start)
+            self._data[start:start + first] = records[:first]
+            self._data[:n - first] = records[first:]
+            self._head += n
+            lost = self._head - self._tail - self.capacity
+            if lost > 0:
+                self.overflow += lost
+                self._tail += lost
+
+    def drain(self, out):
+        """Move up to ``len(out)`` pending records into ``out``.
+
+        Returns the number of records copied.
+        """
+        with self._lock:
+            n = min(len(out), self._head - self._tail)
+            start = self._tail % self.capacity
+            first = min(n, self.capacity - start)
+            out[:first] = self._data[start:start + first]
+            out[first:n] = self._data[:n - first]
+            self._tail += n
+        return n
@@ -0,0 +1,331 @@
+"""Where ``GazeThread`` gets its samples from.
+
+A source hands out samples as an (N, 3) array of ``clock.now()``
+timestamp and normalized screen coordinates, NaN where the eyes were
+lost. Besides the tracker and the mouse, gaze can be synthesized or
+replayed from a recorded session, which is paced in real time like a
+tracker so the whole pipeline can be run and measured without one;
+``run_outlet`` publishes such a source as a stand-in for
+TobiiStreamEngine.
+"""
+import time
+
+import numpy as np
+
+from et_label_app.utils import clock
+
+
+TOBII_STREAM = "TobiiStreamEngine_gaze"
+
+
+class GazeSource(object):
+
+    name = None
+
+    def open(self):
+        """Connect; returns False when the source is unavailable."""
+        return True
+
+    def read(self, timeout, until=None):
+        """Samples that arrived, or None if none did within ``timeout``
+        seconds.
+
+        When ``until``, a ``clock.now()`` time, is given, the source waits
+        for it once the first sample is there, so the samples in between are
+        returned together.
+        """
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class LslSource(GazeSource):
+    """The tracker's LSL stream, timestamps mapped onto ``clock.now()``."""
+
+    name = "gaze"
+
+    def __init__(self, stream=TOBII_STREAM, resolve_timeout=2):
+        self.stream = stream
+        self.resolve_timeout = resolve_timeout
+        self.inlet = None
+
+    def open(self):
+        from pylsl import proc_clocksync, StreamInlet, resolve_byprop
+
+        streams = resolve_byprop("name", self.stream, 1, self.resolve_timeout)
+        if not streams:
+            return False
+        self.inlet = StreamInlet(streams[0], processing_flags=proc_clocksync)
+        return True
+
+    def read(self, timeout, until=None):
+        """Block until the tracker sends data, then drain the inlet.
+
+        The first sample wakes the thread up; it then sleeps until
+        ``until`` so the rest of the chunk piles up in the inlet and is
+        fetched in one call instead of spinning on it. Raises RuntimeError
+        (pylsl's LostError) when the stream goes away.
+        """
+        sample, timestamp = self.inlet.pull_sample(timeout=timeout)
+        if timestamp is None:
+            return None
+        if until is not None:
+            remaining = until - clock.now()
+            if remaining > 0:
+                time.sleep(remaining)
+        chunk, timestamps = self.inlet.pull_chunk(timeout=0.0)
+
+        # missing points come as None and become NaN here
+        samples = np.empty((len(timestamps) + 1, 3))
+        samples[0, 0] = timestamp
+        samples[0, 1:] = np.array(sample[:2], dtype=float)
+        if timestamps:
+            samples[1:, 0] = timestamps
+            samples[1:, 1:] = np.array(chunk, dtype=float)[:, :2]
+        return samples
+
+    def close(self):
+        if self.inlet is not None:
+            self.inlet.close_stream()
+            self.inlet = None
+
+
+class MouseSource(GazeSource):
+    """The cursor, polled every ``interval`` seconds."""
+
+    name = "mouse"
+
+    def __init__(self, interval=0.001):
+        self.interval = interval
+        self.screen_size = None
+
+    def open(self):
+        from qtpy import QtWidgets
+
+        screen = QtWidgets.QDesktopWidget().screenGeometry(-1)
+        self.screen_size = screen.width(), screen.height()
+        return True
+
+    def read(self, timeout, until=None):
+        from qtpy import QtGui
+
+        pos = QtGui.QCursor().pos()
+        samples = np.array([[
+            clock.now(),
+            pos.x() / self.screen_size[0],
+            pos.y() / self.screen_size[1],
+        ]])
+        time.sleep(self.interval)
+        return samples
+
+
+class PacedSource(GazeSource):
+    """Samples known in advance, handed out as they fall due.
+
+    ``_more`` supplies the samples following the current ones, with times
+    relative to ``open``; each is stamped with the ``clock.now()`` time it
+    falls due, as a tracker would.
+    """
+
+    def __init__(self):
+        self._times = np.empty(0)
+        self._points = np.empty((0, 2))
+        self._start = None
+        self._done = False
+
+    def _more(self):
+        """Next (times, points), or None when there are no more."""
+        raise NotImplementedError
+
+    def _extend(self):
+        if self._done:
+            return False
+        more = self._more()
+        if more is None:
+            self._done = True
+            return False
+        self._times = np.concatenate([self._times, more[0]])
+        self._points = np.concatenate([self._points, more[1]])
+        return True
+
+    def open(self):
+        self._start = clock.now()
+        return True
+
+    def read(self, timeout, until=None):
+        if not len(self._times) and not self._extend():
+            time.sleep(timeout)
+            return None
+        now = clock.now()
+        wake = max(self._start + self._times[0], until or 0)
+        if wake > now + timeout:
+            time.sleep(timeout)
+            return None
+        if wake > now:
+            time.sleep(wake - now)
+        elapsed = clock.now() - self._start
+        while self._times[-1] <= elapsed and self._extend():
+            pass
+
+        n = np.searchsorted(self._times, elapsed, side="right")
+        samples = np.empty((n, 3))
+        samples[:, 0] = self._start + self._times[:n]
+        samples[:, 1:] = self._points[:n]
+        self._times = self._times[n:]
+        self._points = self._points[n:]
+        return samples
+
+
+def fixations_and_saccades(
+    rng, rate=1200, width=1920, height=1080, noise=0.05
+):
+    """Endless fixation/saccade trace in pixels, one (x, y) pair of
+    arrays per fixation and the saccade that ends it.
+
+    Fixations last 150-500 ms with ``noise`` px of noise, saccades 30 ms
+    of linear motion to a uniformly drawn point.
+    """
+    px, py = width / 2, height / 2
+    s = max(int(0.03 * rate), 1)
+    f = np.linspace(0, 1, s)
+    while True:
+        k = max(int(rng.uniform(0.15, 0.5) * rate), 1)
+        nx, ny = rng.uniform(0, width), rng.uniform(0, height)
+        yield (
+            np.concatenate([px + rng.normal(0, noise, k), px + (nx - px) * f]),
+            np.concatenate([py + rng.normal(0, noise, k), py + (ny - py) * f]),
+        )
+        px, py = nx, ny
+
+
+def synthetic_gaze(n, rate=1200, seed=0, width=1920, height=1080,
+                   noise=0.05, loss=0.001):
+    """Fixation/saccade trace of ``n`` samples in pixels, as
+    ``(t, x, y)``; a ``loss`` fraction of the samples is lost (NaN).
+    """
+    rng = np.random.default_rng(seed)
+    x = []
+    y = []
+    count = 0
+    for bx, by in fixations_and_saccades(rng, rate, width, height, noise):
+        x.append(bx)
+        y.append(by)
+        count += len(bx)
+        if count >= n:
+            break
+    x = np.concatenate(x)[:n]
+    y = np.concatenate(y)[:n]
+    lost = rng.random(n) < loss
+    x[lost] = np.nan
+    y[lost] = np.nan
+    return np.arange(n) / rate, x, y
+
+
+class SyntheticSource(PacedSource):
+    """Endless synthetic fixations and saccades at ``rate`` Hz."""
+
+    name = "synthetic"
+
+    def __init__(self, rate=1200, seed=None, noise=0.05, loss=0.001,
+                 screen_size=(1920, 1080)):
+        super(SyntheticSource, self).__init__()
+        self.rate = rate
+        self.loss = loss
+        self.screen_size = np.asarray(screen_size, float)
+        self._rng = np.random.default_rng(seed)
+        self._trace = fixations_and_saccades(
+            self._rng, rate, screen_size[0], screen_size[1], noise
+        )
+        self._count = 0
+
+    def _more(self):
+        x, y = next(self._trace)
+        points = np.column_stack([x, y]) / self.screen_size
+        points[self._rng.random(len(points)) < self.loss] = np.nan
+        times = (self._count + np.arange(len(points))) / self.rate
+        self._count += len(points)
+        return times, points
+
+
+class ReplaySource(PacedSource):
+    """The raw gaze of a recorded session, at ``speed`` times its pace."""
+
+    name = "replay"
+
+    def __init__(self, session_dir, speed=1.0, loop=True):
+        from et_label_app.gaze.storage import load_gaze
+
+        super(ReplaySource, self).__init__()
+        self.loop = loop
+        gaze = load_gaze(session_dir)
+        if not len(gaze):
+            raise ValueError("no gaze recorded in {}".format(session_dir))
+        times = gaze["timestamp"] - gaze["timestamp"][0]
+        self._recorded = (
+            times / speed,
+            np.column_stack([gaze["raw_x"], gaze["raw_y"]]).astype(float),
+        )
+        # one mean sample interval between the end and the next loop
+        self._period = self._recorded[0][-1] * len(times) / max(
+            len(times) - 1, 1
+        )
+        self._offset = None
+
+    def _more(self):
+        if self._offset is None:
+            self._offset = 0.0
+        elif self.loop and self._period > 0:
+            self._offset += self._period
+        else:
+            return None
+        return self._recorded[0] + self._offset, self._recorded[1]
+
+
+def create_source(config):
+    """The source named by the ``source`` key of a ``gaze`` config
+    section; None for ``auto``, the tracker with the mouse as fallback.
+    """
+    kind = config.get("source", "auto")
+    if kind == "auto":
+        return None
+    if kind == "lsl":
+        return LslSource(config.get("stream", TOBII_STREAM))
+    if kind == "mouse":
+        return MouseSource()
+    if kind == "synthetic":
+        return SyntheticSource(rate=config.get("rate", 1200))
+    if kind == "replay":
+        return ReplaySource(config["replay"])
+    raise ValueError("unknown gaze source {!r}".format(kind))
+
+
+def run_outlet(source, stream=TOBII_STREAM, rate=1200, duration=None,
+               interval=0.01):
+    """Publish ``source`` as an LSL stream named ``stream``, the way the
+    tracker does, for ``duration`` seconds or until interrupted.
+
+    Returns the number of samples pushed.
+    """
+    import pylsl
+
+    info = pylsl.StreamInfo(
+        stream, "Gaze", 2, rate, "float32", "et_label_app-" + source.name
+    )
+    outlet = pylsl.StreamOutlet(info)
+    source.open()
+    end = None if duration is None else clock.now() + duration
+    count = 0
+    try:
+        while end is None or clock.now() < end:
+            samples = source.read(interval)
+            if samples is None:
+                continue
+            for timestamp, x, y in samples:
+                outlet.push_sample([x, y], timestamp)
+            count += len(samples)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        source.close()
+    return count
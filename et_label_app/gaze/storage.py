@@ -0,0 +1,152 @@
+import datetime
+import json
+import os
+import os.path as osp
+import struct
+
+import numpy as np
+
+
+GAZE_DTYPE = np.dtype([
+    ("timestamp", "<f8"),
+    ("raw_x", "<f4"),  # normalized screen coordinates
+    ("raw_y", "<f4"),
+    ("x", "<f4"),  # image coordinates
+    ("y", "<f4"),
+    ("frame_idx", "<i4"),  # -1 for still images
+])
+
+FRAME_DTYPE = np.dtype([
+    ("present", "<f8"),  # handed to the GUI by the video thread
+    ("display", "<f8"),  # painted by the canvas
+])
+
+GAZE_FILE = "gaze.npy"
+FRAMES_FILE = "frames.npy"  # FRAME_DTYPE, one record per video frame
+META_FILE = "session.json"
+
+_MAGIC = b"\x93NUMPY\x01\x00"
+
+
+def _npy_header(dtype, length, size=None):
+    header = "{'descr': %r, 'fortran_order': False, 'shape': (%d,), }" % (
+        np.lib.format.dtype_to_descr(dtype), length
+    )
+    if size is None:
+        return header
+    pad = size - len(_MAGIC) - 2 - len(header) - 1
+    return b"".join([
+        _MAGIC,
+        struct.pack("<H", size - len(_MAGIC) - 2),
+        header.encode("latin1"),
+        b" " * pad,
+        b"\n",
+    ])
+
+
+class NpyAppender(object):
+    """Append-only writer for a one-dimensional ``.npy`` file.
+
+    The header is written with a fixed size so that the record count can
+    be rewritten in place after every flush; the file is therefore a
+    valid ``.npy`` at any time and can be memory-mapped while it grows.
+    """
+
+    def __init__(self, path, dtype):
+        self.path = path
+        self.dtype = np.dtype(dtype)
+        # room for the largest record count, aligned like numpy does
+        longest = len(_npy_header(self.dtype, 10 ** 18))
+        self._header_size = (len(_MAGIC) + 2 + longest + 1 + 63) // 64 * 64
+        self.length = 0
+        self._file = open(path, "wb")
+        self._write_header()
+
+    def _write_header(self):
+        self._file.seek(0)
+        self._file.write(
+            _npy_header(self.dtype, self.length, self._header_size)
+        )
+        self._file.seek(0, os.SEEK_END)
+
+    def append(self, records):
+        records = np.ascontiguousarray(records, dtype=self.dtype)
+        self._file.write(records.tobytes())
+        self.length += len(records)
+
+    def flush(self):
+        self._write_header()
+        self._file.flush()
+
+    def close(self):
+        if self._file.closed:
+            return
+        self.flush()
+        self._file.close()
+
+
+def open_array(path, mmap_mode="r"):
+    """Open a file written by ``NpyAppender``.
+
+    The record count is taken from the file size, so files left behind by
+    an interrupted session are still readable up to the last full record.
+    """
+    with open(path, "rb") as f:
+        version = np.lib.format.read_magic(f)
+        if version == (1, 0):
+            _, _, dtype = np.lib.format.read_array_header_1_0(f)
+        else:
+            _, _, dtype = np.lib.format.read_array_header_2_0(f)
+        offset = f.tell()
+        length = (osp.getsize(path) - offset) // dtype.itemsize
+        if mmap_mode is None or length == 0:
+            return np.fromfile(f, dtype=dtype, count=length)
+    return np.memmap(
+        path, dtype=dtype, mode=mmap_mode, offset=offset, shape=(length,)
+    )
+
+
+def session_name(stimulus, when=None):
+    when = when or datetime.datetime.now()
+    stem = osp.splitext(osp.basename(stimulus))[0] if stimulus else "session"
+    return "{}-{}".format(stem, when.strftime("%Y%m%d-%H%M%S"))
+
+
+def write_meta(session_dir, meta):
+    with open(osp.join(session_dir, META_FILE), "w") as f:
+        json.dump(meta, f, indent=2)
+
+
+def load_meta(session_dir):
+    with open(osp.join(session_dir, META_FILE)) as f:
+        return json.load(f)
+
+
+def find_sessions(path):
+    """Session folders at or below ``path``, sorted."""
+    if osp.exists(osp.join(path, META_FILE)):
+        return [path]
+    return sorted(
+        root for root, _, files in os.walk(path) if META_FILE in files
+    )
+
+
+def load_gaze(session_dir, mmap_mode="r"):
+    return open_array(osp.join(session_dir, GAZE_FILE), mmap_mode=mmap_mode)
+
+
+def write_frames(session_dir, frame_times):
+    np.save(osp.join(session_dir, FRAMES_FILE), frame_times)
+
+
+def load_frames(session_dir):
+    path = osp.join(session_dir, FRAMES_FILE)
+    if not osp.exists(path):
+        return None
+    frames = np.load(path)
+    if frames.dtype.names is None:
+        # older sessions only kept presentation times
+        present = frames
+        frames = np.full(len(present), np.nan, dtype=FRAME_DTYPE)
+        frames["present"] = present
+    return frames
@@ -1,14 +1,34 @@
 import time
 
+import numpy as np
+
 from qtpy import QtCore
-from qtpy import QtGui
 from qtpy import QtWidgets
 
-from pylsl import StreamInlet, resolve_byprop
+from et_label_app.gaze.sources import LslSource
+from et_label_app.gaze.sources import MouseSource
+from et_label_app.utils import clock
 
 
 class GazeThread(QtCore.QThread):
+    # one sample: (timestamp, QPoint on screen, (raw_x, raw_y))
     point_signal = QtCore.Signal(object)
+    # all samples since the last emit: (N, 3) array of timestamp, raw_x, raw_y
+    chunk_signal = QtCore.Signal(object)
+
+    batched = True  # emit chunk_signal instead of point_signal
+    emit_interval = 1 / 120  # seconds between two chunk_signal
+    pull_timeout = 0.1  # longest block on the source, bounds stop() latency
+    mouse_interval = 0.001  # seconds between two cursor polls
+    cpu_load = 0.0  # fraction of one core used by this thread
+    trace = None  # LatencyTrace fed with the pulled and emitted stages
+    # GazeSource to read; None for the tracker, falling back to the mouse
+    source = None
+    point_type = None  # name of the source in use
+
+    def stop(self):
+        self.requestInterruption()
+        self.wait()
 
     def run(self):
         # window size
@@ -16,32 +36,68 @@ class GazeThread(QtCore.QThread):
         win_size_height = win_size.height()
         win_size_width = win_size.width()
 
-        # gaze stream
-        try:
-            streams = resolve_byprop("name", "TobiiStreamEngine_gaze", 1, 2)
-            inlet = StreamInlet(streams[0])
-            point_type = "gaze"
-        except:
-            print("Timed out for operation TobiiStreamEngine_gaze, use mouse instead")
-            point_type = "mouse"
-
-        while True:
-            if point_type == "gaze":
-                chunk, timestamps = inlet.pull_chunk()
-                if timestamps:
-                    try:
-                        self.point_signal.emit((
-                            timestamps[-1],
-                            QtCore.QPoint(
-                                int(chunk[-1][0]*win_size_width),
-                                int(chunk[-1][1]*win_size_height)
-                            )
-                        ))
-                    except:
-                        pass # some point is None
-            elif point_type == "mouse":
+        source = self.source
+        if source is None:
+            source = LslSource()
+            if not source.open():
+                print("Timed out for operation TobiiStreamEngine_gaze, use mouse instead")
+                source = MouseSource(self.mouse_interval)
+                source.open()
+        elif not source.open():
+            print("Gaze source {} unavailable".format(source.name))
+            return
+        self.point_type = source.name
+
+        pending = []
+        pulled = None  # clock.now() of the newest pending sample
+        last_emit = clock.now()
+        cpu_window = (time.time(), time.thread_time())
+        while not self.isInterruptionRequested():
+            try:
+                samples = source.read(
+                    self.pull_timeout,
+                    last_emit + self.emit_interval if self.batched else None,
+                )
+            except RuntimeError:  # pylsl LostError
+                print("Lost TobiiStreamEngine_gaze, stop reading gaze")
+                break
+
+            now = time.time()
+            if now - cpu_window[0] >= 1:
+                self.cpu_load = (
+                    (time.thread_time() - cpu_window[1])
+                    / (now - cpu_window[0])
+                )
+                cpu_window = (now, time.thread_time())
+
+            if samples is None or not len(samples):
+                continue
+            pulled = clock.now()
+
+            if not self.batched:
+                timestamp, x, y = samples[-1]
+                if np.isnan(x) or np.isnan(y):
+                    continue
+                self._trace(timestamp, pulled)
                 self.point_signal.emit((
-                    time.time(),
-                    QtGui.QCursor().pos()
+                    timestamp,
+                    QtCore.QPoint(
+                        int(x*win_size_width),
+                        int(y*win_size_height)
+                    ),
+                    (x, y)
                 ))
-                time.sleep(0.001)
+                continue
+
+            pending.append(samples)
+            if pulled - last_emit >= self.emit_interval:
+                chunk = np.concatenate(pending)
+                self._trace(chunk[-1, 0], pulled)
+                self.chunk_signal.emit(chunk)
+                pending = []
+                last_emit = pulled
+        source.close()
+
+    def _trace(self, timestamp, pulled):
+        if self.trace is not None:
+            self.trace.begin(timestamp, pulled=pulled, emitted=clock.now())
@@ -0,0 +1,108 @@
+import os
+import os.path as osp
+import threading
+
+import numpy as np
+
+from qtpy import QtCore
+
+from et_label_app.gaze import GAZE_DTYPE
+from et_label_app.gaze import NpyAppender
+from et_label_app.gaze import RingBuffer
+from et_label_app.gaze import write_meta
+from et_label_app.gaze.storage import GAZE_FILE
+
+
+class RecorderThread(QtCore.QThread):
+    """Write every pushed gaze sample to ``<session_dir>/gaze.npy``.
+
+    ``push`` only copies into a preallocated ring buffer, so it is cheap
+    enough to call from the GUI thread for every sample. The thread wakes
+    up every ``flush_interval`` seconds, or as soon as ``chunk_size``
+    samples are pending, and appends them to disk in one write.
+    """
+
+    def __init__(
+        self,
+        buffer_size=2 ** 18,
+        chunk_size=4096,
+        flush_interval=0.5,
+        parent=None,
+    ):
+        super(RecorderThread, self).__init__(parent)
+        self.buffer = RingBuffer(buffer_size, GAZE_DTYPE)
+        self.chunk_size = chunk_size
+        self.flush_interval = flush_interval
+        self.session_dir = None
+        self._appender = None
+        self._wake = threading.Event()
+
+    @property
+    def recording(self):
+        return self._appender is not None
+
+    def start_session(self, session_dir, meta=None):
+        if self.recording:
+            self.stop_session()
+        if not osp.exists(session_dir):
+            os.makedirs(session_dir)
+        meta = dict(meta or {})
+        meta["fields"] = list(GAZE_DTYPE.names)
+        write_meta(session_dir, meta)
+
+        self.session_dir = session_dir
+        self.buffer.clear()
+        self._appender = NpyAppender(
+            osp.join(session_dir, GAZE_FILE), GAZE_DTYPE
+        )
+        self._wake.clear()
+        self.start()
+
+    def stop_session(self):
+        if not self.recording:
+            return
+        self.requestInterruption()
+        self._wake.set()
+        self.wait()
+        self._appender.close()
+        self._appender = None
+        if self.buffer.overflow:
+            print(
+                "Recorder dropped {} samples, consider a larger "
+                "buffer_size".format(self.buffer.overflow)
+            )
+
+    def push(self, timestamps, raw, points, frame_idx=-1):
+        """Queue samples given as arrays of shape (N,), (N, 2), (N, 2)."""
+        if not self.recording:
+            return
+        records = np.empty(len(timestamps), dtype=GAZE_DTYPE)
+        records["timestamp"] = timestamps
+        records["raw_x"], records["raw_y"] = np.asarray(raw, np.float32).T
+        records["x"], records["y"] = np.asarray(points, np.float32).T
+        records["frame_idx"] = frame_idx
+        self.buffer.push(records)
+        if len(self.buffer) >= self.chunk_size:
+            self._wake.set()
+
+    def push_sample(self, timestamp, raw, point, frame_idx=-1):
+        self.push([timestamp], [raw], [point], frame_idx)
+
+    def run(self):
+        chunk = np.empty(self.chunk_size, dtype=GAZE_DTYPE)
+        while not self.isInterruptionRequested():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            self._flush(chunk)
+        self._flush(chunk)
+
+    def _flush(self, chunk):
+        written = False
+        while True:
+            n = self.buffer.drain(chunk)
+            if n == 0:
+                break
+            self._appender.append(chunk[:n])
+            written = True
+        if written:
+            self._appender.flush()
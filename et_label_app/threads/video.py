@@ -1,66 +1,297 @@
+import queue
+import threading
 import time
-import cv2
+
+import numpy as np
 
 from qtpy import QtCore
-from qtpy import QtGui
 
+from et_label_app.gaze import FRAME_DTYPE
+from et_label_app.utils import clock
 from et_label_app.utils import img_npy_to_qimage
 
 
+class FramePool(object):
+    """Recycle up to ``size`` frame buffers between decoder and GUI.
+
+    ``acquire`` returns ``None`` while fewer than ``size`` buffers exist,
+    letting OpenCV allocate one; every buffer handed back to ``release``
+    is then reused, so steady-state playback allocates nothing.
+    """
+
+    def __init__(self, size):
+        self.size = size
+        self.allocated = 0
+        self._free = queue.Queue()
+        self._lock = threading.Lock()
+
+    def acquire(self, timeout=None):
+        try:
+            return self._free.get_nowait()
+        except queue.Empty:
+            pass
+        with self._lock:
+            if self.allocated < self.size:
+                self.allocated += 1
+                return None
+        return self._free.get(timeout=timeout)
+
+    def release(self, buffer):
+        self._free.put(buffer)
+
+
+class VideoFrame(object):
+    """A decoded frame whose pixels still belong to a ``FramePool``.
+
+    ``image`` wraps the pooled buffer. A pixmap made from it with
+    ``QPixmap.fromImage`` may share that buffer, so ``release`` it only
+    once the pixmap is no longer shown.
+    """
+
+    __slots__ = ("index", "timestamp", "image", "_buffer", "_pool")
+
+    def __init__(self, index, buffer, pool):
+        self.index = index
+        self.timestamp = None
+        self.image = None
+        self._buffer = buffer
+        self._pool = pool
+
+    def release(self):
+        if self._buffer is not None:
+            self.image = None
+            self._pool.release(self._buffer)
+            self._buffer = None
+
+
+class FrameDecoder(QtCore.QThread):
+    """Decode frames of a ``VideoSession`` ahead of playback.
+
+    Decoding starts at the session's current position. Items put in the
+    bounded ``queue`` are ``VideoFrame``; ``None`` marks the end of the
+    stream. Frames are converted into buffers from a ``FramePool`` of
+    ``depth + 3`` buffers (queue, presenter, signal in flight and frame on
+    screen), and the thread blocks while the queue is full or all buffers
+    are in use.
+    """
+
+    def __init__(self, session, depth=8, parent=None):
+        super(FrameDecoder, self).__init__(parent)
+        self.session = session
+        self.queue = queue.Queue(maxsize=depth)
+        self.pool = FramePool(depth + 3)
+        self.decoded_frames = 0
+        self.decode_time = 0.0  # seconds spent in read + conversion
+
+    @property
+    def decode_latency(self):
+        if not self.decoded_frames:
+            return 0.0
+        return self.decode_time / self.decoded_frames
+
+    def run(self):
+        frame_idx = self.session.position
+        frame = None  # decode target, reused for every frame
+        while not self.isInterruptionRequested():
+            ok, buffer = self._acquire()
+            if not ok:
+                break
+            t = time.perf_counter()
+            ret, frame = self.session.read(image=frame)
+            item = None
+            if ret:
+                image = img_npy_to_qimage(frame, out=buffer)
+                item = VideoFrame(frame_idx, image.ndarray, self.pool)
+                item.image = image
+                self.decode_time += time.perf_counter() - t
+                self.decoded_frames += 1
+                frame_idx += 1
+            if not self._put(item) or item is None:
+                break
+
+    def _acquire(self):
+        while not self.isInterruptionRequested():
+            try:
+                return True, self.pool.acquire(timeout=0.1)
+            except queue.Empty:
+                pass
+        return False, None
+
+    def _put(self, item):
+        while not self.isInterruptionRequested():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def get(self, timeout):
+        try:
+            return True, self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return False, None
+
+    def stop(self):
+        self.requestInterruption()
+        self.wait()
+
+
 class VideoThread(QtCore.QThread):
-    video_signal = QtCore.Signal(QtGui.QPixmap)
-    video_path = None
+    # VideoFrame, to be released by the receiver once it has been painted
+    video_signal = QtCore.Signal(object)
+    session = None
     video_info = None
     play = False
+    prefetch = 8  # frames decoded ahead of playback
+    decoder = None
+    frame_idx = -1
+    frame_times = None  # FRAME_DTYPE per frame, NaN if skipped
+    dropped_frames = 0
+    _seek_request = None
+
+    def __init__(self, parent=None):
+        super(VideoThread, self).__init__(parent)
+        self._frame_lock = threading.Lock()
 
     def run(self):
         # init value
-        video_path = None
+        session = None
         fps = None
-        height = None
-        width = None
-        cap = None
+        decoder = None
+        start = None  # time.perf_counter() at which frame 0 is due
 
         # run
-        while True:
-            # create cap
-            if self.video_path != video_path:
-                video_path = self.video_path
-                cap = cv2.VideoCapture(video_path)
-                fps = cap.get(cv2.CAP_PROP_FPS)
-                width = cv2.CAP_PROP_FRAME_WIDTH
-                height = cv2.CAP_PROP_FRAME_HEIGHT
+        while not self.isInterruptionRequested():
+            # switch session
+            if self.session is not session:
+                if decoder is not None:
+                    decoder.stop()
+                if session is not None:
+                    session.release()
+                session = self.session
+                fps = session.fps
                 self.video_info = {
-                    "video_path": video_path,
+                    "video_path": session.video_path,
                     "fps": fps,
-                    "width": width,
-                    "height": height
+                    "width": session.width,
+                    "height": session.height,
+                    "frame_count": session.frame_count,
                 }
                 self.read_next = True
-                self.frame_idx = -1
-
-            if cap is not None and cap.isOpened() and self.play:
-                ret, frame = cap.read()
-                if ret == True:
-                    self.frame_idx += 1
-                    self.video_signal.emit(
-                        QtGui.QPixmap.fromImage(
-                            img_npy_to_qimage(frame)
-                        )
+                self.frame_idx = session.position - 1
+                with self._frame_lock:
+                    self.frame_times = np.full(
+                        session.frame_count, np.nan, dtype=FRAME_DTYPE
                     )
-            else:
-                self.stop_video()
+                self.dropped_frames = 0
+                start = None
+                decoder = None
+                if session.isOpened():
+                    decoder = self._start_decoder(session)
+
+            # random access: restart decoding from the requested frame
+            seek, self._seek_request = self._seek_request, None
+            if seek is not None and decoder is not None:
+                decoder.stop()
+                unit, value = seek
+                if unit == "time":
+                    frame_idx = session.seek_time(value)
+                else:
+                    frame_idx = session.seek(value)
+                self.frame_idx = frame_idx - 1
+                start = None
+                decoder = self._start_decoder(session)
+                if not self.play:
+                    # show the target frame right away when scrubbing
+                    ok, item = decoder.get(timeout=1)
+                    if ok and item is not None:
+                        self._present(item)
 
-            if cap is None or not self.play:
+            if decoder is None or not self.play:
+                start = None  # reschedule from the current frame on resume
                 time.sleep(0.01)
-            else:
-                time.sleep(1/fps)
+                continue
+
+            ok, item = decoder.get(timeout=0.1)
+            if not ok:
+                continue  # decoder is late, the next frame may be too
+            if item is None:
+                self.stop_video()
+                continue
+            frame_idx = item.index
+
+            # frame i is due at start + i / fps, whatever decoding costs
+            if start is None:
+                start = time.perf_counter() - frame_idx / fps
+            delay = start + frame_idx / fps - time.perf_counter()
+            if delay < -1 / fps:
+                # its slot has already passed, show the next one instead
+                self.dropped_frames += 1
+                item.release()
+                continue
 
-    def load_video(self, video_path):
-        self.video_path = video_path
+            delay = start + frame_idx / fps - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            self._present(item)
+
+        if decoder is not None:
+            decoder.stop()
+        if session is not None:
+            session.release()
+
+    def _start_decoder(self, session):
+        self.decoder = FrameDecoder(session, depth=self.prefetch)
+        self.decoder.start()
+        return self.decoder
+
+    def _present(self, item):
+        self.frame_idx = item.index
+        item.timestamp = clock.now()
+        self.set_frame_time(item.index, "present", item.timestamp)
+        self.video_signal.emit(item)
+
+    def set_frame_time(self, frame_idx, field, timestamp):
+        """Record a ``clock.now()`` time of a frame; ``field`` is one of
+        ``FRAME_DTYPE``. The GUI records ``display`` times."""
+        with self._frame_lock:
+            if frame_idx >= len(self.frame_times):
+                # CAP_PROP_FRAME_COUNT is only an estimate for some
+                # containers
+                size = max(2 * len(self.frame_times), frame_idx + 1, 1024)
+                grown = np.full(size, np.nan, dtype=FRAME_DTYPE)
+                grown[:len(self.frame_times)] = self.frame_times
+                self.frame_times = grown
+            self.frame_times[field][frame_idx] = timestamp
+
+    @property
+    def stats(self):
+        decoder = self.decoder
+        if decoder is None:
+            return {}
+        return {
+            "queue_depth": decoder.queue.qsize(),
+            "dropped_frames": self.dropped_frames,
+            "decode_latency": decoder.decode_latency,  # seconds per frame
+        }
+
+    def load_video(self, session):
+        """Play ``session`` (a ``VideoSession``) from its current position."""
+        self.session = session
+
+    def seek(self, frame_idx):
+        self._seek_request = ("frame", int(frame_idx))
+
+    def seek_time(self, seconds):
+        self._seek_request = ("time", float(seconds))
 
     def start_video(self):
         self.play = True
 
     def stop_video(self):
         self.play = False
+
+    def stop(self):
+        self.requestInterruption()
+        self.wait()
@@ -7,7 +7,23 @@ from .image import img_data_to_pil
 from .image import img_data_to_png_data
 from .image import img_pil_to_data
 from .image import img_npy_to_qimage
-from .image import get_video_first_frame
+from .image import img_pil_to_qimage
+from .image import img_file_to_qimage
+
+from .video import VideoIndex
+from .video import VideoSession
+
+from .pyramid import ImagePyramid
+
+from .image_cache import ImageCache
+
+from .clock import frame_at
+from .clock import measure_offset
+
+from .trace import LatencyTrace
+from .trace import latency_stats
+
+from .trail import Trail
 
 from .qt import newIcon
 from .qt import newButton
@@ -0,0 +1,43 @@
+"""One timeline for gaze samples, video frames and the display.
+
+Everything is stamped with ``now``, LSL's ``local_clock``, which is also
+the clock of gaze samples once the inlet has applied its time correction.
+Other clocks are related to it by a measured offset.
+"""
+import numpy as np
+import pylsl
+
+
+def now():
+    return pylsl.local_clock()
+
+
+def measure_offset(clock, reference=now, samples=100):
+    """Offset to add to readings of ``clock`` to get ``reference`` ones.
+
+    Every estimate brackets one ``clock`` reading between two of
+    ``reference``; the tightest bracket is kept.
+    """
+    best = float("inf"), 0.0
+    for _ in range(samples):
+        before = reference()
+        t = clock()
+        after = reference()
+        best = min(best, (after - before, (before + after) / 2 - t))
+    return best[1]
+
+
+def frame_at(timestamps, frame_times):
+    """Index of the frame on screen at each of ``timestamps``.
+
+    ``frame_times`` holds the time each frame was shown, NaN for frames
+    never shown. Frames are looked up by time, so seeks are handled;
+    timestamps before the first frame get -1.
+    """
+    shown = np.flatnonzero(~np.isnan(frame_times))
+    if not len(shown):
+        return np.full(len(timestamps), -1, dtype=np.int64)
+    order = np.argsort(frame_times[shown], kind="stable")
+    shown = shown[order]
+    i = np.searchsorted(frame_times[shown], timestamps, side="right") - 1
+    return np.where(i >= 0, shown[np.maximum(i, 0)], -1)
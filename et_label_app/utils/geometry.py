@@ -0,0 +1,150 @@
+"""Geometry of many points at once.
+
+Points are (N, 2) arrays of x, y; a rectangle ``size`` is the (width,
+height) of an image whose pixels span 0..width - 1 and 0..height - 1.
+The functions named in the singular take one point as an (x, y) pair
+and are plain Python: for a single point NumPy's call overhead is
+several times the work itself.
+"""
+import math
+
+import numpy as np
+
+
+def widget_to_image(points, scale, offset):
+    """Map widget coordinates to image ones, for an image drawn at
+    ``scale`` and shifted by ``offset`` image pixels."""
+    return np.asarray(points, float) / scale - np.asarray(offset, float)
+
+
+def outside(points, size):
+    """Mask of the points outside the image."""
+    points = np.asarray(points, float)
+    x, y = points[..., 0], points[..., 1]
+    w, h = size
+    return ~((x >= 0) & (x <= w - 1) & (y >= 0) & (y <= h - 1))
+
+
+def clip_segments(p1, p2, size):
+    """Where the segments from ``p1`` to ``p2`` cross the image border.
+
+    ``p1`` is clamped into the image first. Of the border edges a
+    segment crosses, the one whose middle is closest to ``p2`` wins
+    (http://paulbourke.net/geometry/lineline2d/). When the crossing is
+    ``p1`` itself, the point slides along that edge towards ``p2``.
+    Segments crossing no edge end at ``p2`` clamped into the image.
+    """
+    w, h = size[0] - 1, size[1] - 1
+    p2 = np.asarray(p2, float)
+    p1 = np.clip(np.asarray(p1, float), 0, (w, h))
+    x1, y1 = p1[:, :1], p1[:, 1:]
+    x2, y2 = p2[:, :1], p2[:, 1:]
+
+    # edge i runs from corner i to corner i + 1, clockwise
+    corners = np.array([(0, 0), (w, 0), (w, h), (0, h)], float)
+    x3, y3 = corners[:, 0], corners[:, 1]
+    x4, y4 = np.roll(x3, -1), np.roll(y3, -1)
+    denom = (y4 - y3) * (x2 - x1) - (x4 - x3) * (y2 - y1)
+    nua = (x4 - x3) * (y1 - y3) - (y4 - y3) * (x1 - x3)
+    nub = (x2 - x1) * (y1 - y3) - (y2 - y1) * (x1 - x3)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        ua, ub = nua / denom, nub / denom
+    crosses = (denom != 0) & (ua >= 0) & (ua <= 1) & (ub >= 0) & (ub <= 1)
+    middle = (corners + np.roll(corners, -1, axis=0)) / 2
+    d = np.sqrt((middle[:, 0] - x2) ** 2 + (middle[:, 1] - y2) ** 2)
+    edge = np.argmin(np.where(crosses, d, np.inf), axis=1)
+
+    # segments crossing no edge have no ua to interpolate with
+    clipped = np.clip(p2, 0, (w, h))
+    rows = np.flatnonzero(crosses.any(axis=1))
+    edge = edge[rows]
+    p1, p2 = p1[rows], p2[rows]
+    hit = p1 + ua[rows, edge][:, None] * (p2 - p1)
+    on_edge = (hit == p1).all(axis=1)
+    if on_edge.any():
+        # slide along the edge p1 is on
+        vertical = x3[edge] == x4[edge]
+        slide = np.where(
+            vertical[:, None],
+            np.column_stack([x3[edge], np.clip(p2[:, 1], 0, h)]),
+            np.column_stack([np.clip(p2[:, 0], 0, w), y3[edge]]),
+        )
+        hit[on_edge] = slide[on_edge]
+    clipped[rows] = hit
+    return clipped
+
+
+def clip_segment(p1, p2, size):
+    """``clip_segments`` of one segment."""
+    w, h = size[0] - 1, size[1] - 1
+    x1, y1 = min(max(p1[0], 0), w), min(max(p1[1], 0), h)
+    x2, y2 = p2
+    corners = ((0, 0), (w, 0), (w, h), (0, h))
+    best = None
+    for i in range(4):
+        x3, y3 = corners[i]
+        x4, y4 = corners[(i + 1) % 4]
+        denom = (y4 - y3) * (x2 - x1) - (x4 - x3) * (y2 - y1)
+        if denom == 0:
+            continue
+        ua = ((x4 - x3) * (y1 - y3) - (y4 - y3) * (x1 - x3)) / denom
+        ub = ((x2 - x1) * (y1 - y3) - (y2 - y1) * (x1 - x3)) / denom
+        if 0 <= ua <= 1 and 0 <= ub <= 1:
+            mx, my = (x3 + x4) / 2 - x2, (y3 + y4) / 2 - y2
+            d = math.sqrt(mx * mx + my * my)
+            if best is None or d < best[0]:
+                best = d, i, (x1 + ua * (x2 - x1), y1 + ua * (y2 - y1))
+    if best is None:
+        return min(max(x2, 0), w), min(max(y2, 0), h)
+    _, i, (x, y) = best
+    if (x, y) == (x1, y1):
+        # slide along the edge p1 is on
+        (x3, y3), (x4, y4) = corners[i], corners[(i + 1) % 4]
+        if x3 == x4:
+            return x3, min(max(y2, 0), h)
+        return min(max(x2, 0), w), y3
+    return x, y
+
+
+def distance_to_segments(points, a, b):
+    """Distance from each of ``points`` to the segment from ``a`` to
+    ``b``; the arrays broadcast against each other."""
+    points = np.asarray(points, float)
+    a = np.asarray(a, float)
+    d = np.asarray(b, float) - a
+    length2 = (d * d).sum(axis=-1)
+    with np.errstate(divide="ignore", invalid="ignore"):
+        t = ((points - a) * d).sum(axis=-1) / length2
+    t = np.clip(np.nan_to_num(t), 0, 1)
+    return np.hypot(*np.moveaxis(points - a - t[..., None] * d, -1, 0))
+
+
+def distance_to_segment(point, a, b):
+    """``distance_to_segments`` of one point and segment."""
+    dx, dy = b[0] - a[0], b[1] - a[1]
+    px, py = point[0] - a[0], point[1] - a[1]
+    length2 = dx * dx + dy * dy
+    t = 0.0 if length2 == 0 else (px * dx + py * dy) / length2
+    t = min(max(t, 0.0), 1.0)
+    return math.hypot(px - t * dx, py - t * dy)
+
+
+def inside_polygon(points, polygon):
+    """Mask of the points inside ``polygon``, an (M, 2) array of its
+    vertices, by the even-odd rule. NaN points are outside; points on an
+    edge may fall on either side.
+    """
+    points = np.asarray(points, float)
+    x, y = points[..., 0], points[..., 1]
+    inside = np.zeros(x.shape, bool)
+    polygon = np.asarray(polygon, float)
+    xj, yj = polygon[-1]
+    for xi, yi in polygon:
+        if yi != yj:
+            # edges crossing the horizontal line through the point, left
+            # of it
+            crosses = (yi > y) != (yj > y)
+            with np.errstate(invalid="ignore"):
+                inside ^= crosses & (x < xi + (y - yi) * (xj - xi) / (yj - yi))
+        xj, yj = xi, yi
+    return inside
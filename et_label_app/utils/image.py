@@ -59,18 +59,55 @@ def img_data_to_png_data(img_data):
             return f.read()
 
 
-def img_npy_to_qimage(img_npy):
-    rgb_image = cv2.cvtColor(img_npy, cv2.COLOR_BGR2RGB)
-    h, w, ch = rgb_image.shape
-    bytes_per_line = ch * w
-    return QtGui.QImage(
-        rgb_image.data, w, h,
-        bytes_per_line,
-        QtGui.QImage.Format_RGB888
+def img_pil_to_qimage(img_pil):
+    """Convert a PIL image to a QImage without encoding it, EXIF
+    orientation applied."""
+    img_pil = PIL.ImageOps.exif_transpose(img_pil)
+    if img_pil.mode == "RGBA" or "transparency" in img_pil.info:
+        img_pil = img_pil.convert("RGBA")
+        format = QtGui.QImage.Format_RGBA8888
+    else:
+        img_pil = img_pil.convert("RGB")
+        format = QtGui.QImage.Format_RGB888
+    data = np.asarray(img_pil)
+    h, w = data.shape[:2]
+    qimage = QtGui.QImage(data.data, w, h, data.strides[0], format)
+    qimage.ndarray = data
+    return qimage
+
+
+def img_file_to_qimage(filename):
+    """Decode an image file straight to a QImage, EXIF orientation applied.
+
+    Qt's own reader is used when it supports the format, PIL otherwise.
+    Returns a null QImage if neither can read the file.
+    """
+    reader = QtGui.QImageReader(filename)
+    reader.setAutoTransform(True)
+    qimage = reader.read()
+    if not qimage.isNull():
+        return qimage
+    try:
+        img_pil = PIL.Image.open(filename)
+    except IOError:
+        return QtGui.QImage()
+    return img_pil_to_qimage(img_pil)
+
+
+def img_npy_to_qimage(img_npy, out=None):
+    """Wrap a BGR OpenCV image as a QImage.
+
+    The pixels are converted once, into ``out`` if given, to a (H, W, 4)
+    array laid out as Qt's native ``Format_RGB32`` so that
+    ``QPixmap.fromImage`` needs no further conversion and can share the
+    buffer. The returned image keeps a reference to it in ``ndarray``.
+    """
+    data = cv2.cvtColor(img_npy, cv2.COLOR_BGR2BGRA, dst=out)
+    h, w = data.shape[:2]
+    qimage = QtGui.QImage(
+        data.data, w, h,
+        data.strides[0],
+        QtGui.QImage.Format_RGB32
     )
-
-def get_video_first_frame(video_path):
-    cap = cv2.VideoCapture(video_path)
-    _, image = cap.read()
-    cap.release()
-    return img_npy_to_qimage(image)
+    qimage.ndarray = data
+    return qimage
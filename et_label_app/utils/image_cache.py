@@ -0,0 +1,88 @@
+import collections
+import concurrent.futures
+import os.path as osp
+import threading
+
+
+class ImageCache(object):
+    """Decoded stimulus images, kept until they take up ``max_bytes``.
+
+    The least recently used image is evicted first. ``prefetch`` decodes
+    images in a pool of ``workers`` threads so that a later ``get`` of
+    them returns at once; a ``get`` of an image still being decoded waits
+    for that decode instead of starting another one. Entries are keyed by
+    file name and dropped when the file's modification time changes.
+
+    ``loader`` maps a file name to a ``QImage``, null if it failed.
+    """
+
+    def __init__(self, loader, max_bytes=2 ** 29, workers=2):
+        self.loader = loader
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self._images = collections.OrderedDict()  # name: (mtime, image, size)
+        self._pending = {}  # name: Future of a prefetch
+        self._lock = threading.Lock()
+        self._executor = concurrent.futures.ThreadPoolExecutor(workers)
+
+    def __len__(self):
+        return len(self._images)
+
+    def __contains__(self, filename):
+        return filename in self._images
+
+    def get(self, filename):
+        mtime = osp.getmtime(filename)
+        with self._lock:
+            entry = self._images.pop(filename, None)
+            if entry is not None:
+                if entry[0] == mtime:
+                    self._images[filename] = entry  # most recently used
+                    return entry[1]
+                self.nbytes -= entry[2]
+            future = self._pending.get(filename)
+        if future is not None:
+            return future.result()
+        return self._load(filename)
+
+    def prefetch(self, filenames):
+        with self._lock:
+            for filename in filenames:
+                if filename in self._images or filename in self._pending:
+                    continue
+                self._pending[filename] = self._executor.submit(
+                    self._prefetch, filename
+                )
+
+    def _prefetch(self, filename):
+        try:
+            return self._load(filename)
+        finally:
+            with self._lock:
+                del self._pending[filename]
+
+    def _load(self, filename):
+        mtime = osp.getmtime(filename)
+        image = self.loader(filename)
+        size = image.bytesPerLine() * image.height()
+        if image.isNull() or size > self.max_bytes:
+            return image
+        with self._lock:
+            entry = self._images.pop(filename, None)
+            if entry is not None:
+                self.nbytes -= entry[2]
+            self._images[filename] = mtime, image, size
+            self.nbytes += size
+            while self.nbytes > self.max_bytes:
+                _, (_, _, evicted) = self._images.popitem(last=False)
+                self.nbytes -= evicted
+        return image
+
+    def clear(self):
+        with self._lock:
+            self._images.clear()
+            self.nbytes = 0
+
+    def shutdown(self):
+        """Stop prefetching; decodes already running are not waited for."""
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,198 @@
+import glob
+import math
+import os
+import os.path as osp
+import shutil
+import tempfile
+
+import cv2
+import numpy as np
+import PIL.Image
+import PIL.ImageOps
+
+from qtpy import QtCore
+from qtpy import QtGui
+
+
+PYRAMID_SUFFIX = ".etpyr"
+TILE_SIZE = 512
+STRIP_ROWS = 1024  # rows converted at once while building, kept even
+
+
+def _signature(image_path):
+    stat = osp.getsize(image_path), osp.getmtime(image_path)
+    return np.array(stat, dtype=np.float64)
+
+
+def _read_image(image_path):
+    """Decode ``image_path`` to a BGR array, EXIF orientation applied."""
+    image = cv2.imread(image_path, cv2.IMREAD_COLOR)
+    if image is not None:
+        return image
+    # OpenCV refuses images above CV_IO_MAX_IMAGE_PIXELS
+    try:
+        image_pil = PIL.ImageOps.exif_transpose(PIL.Image.open(image_path))
+    except IOError:
+        return None
+    return np.asarray(image_pil.convert("RGB"))[:, :, ::-1]
+
+
+class ImagePyramid(object):
+    """A stimulus image at several resolutions, stored as tiles on disk.
+
+    Level ``k`` is the image downsampled by ``2 ** k``, down to a level
+    fitting in one tile. Levels are ``.npy`` files in Qt's native
+    ``Format_RGB32`` layout, memory-mapped so that only the tiles being
+    shown are read. They are cached next to the image in
+    ``<image>.etpyr`` (or a temporary directory if that is not writable)
+    and rebuilt when the image's size or modification time changes.
+    A temporary directory is removed by ``close``.
+    """
+
+    def __init__(self, levels, tile_size=TILE_SIZE):
+        self.levels = levels  # (H, W, 4) uint8 arrays, finest first
+        self.tile_size = tile_size
+        self.temp_dir = None  # cache directory to remove on close
+
+    @property
+    def width(self):
+        return self.levels[0].shape[1]
+
+    @property
+    def height(self):
+        return self.levels[0].shape[0]
+
+    def size(self):
+        return QtCore.QSize(self.width, self.height)
+
+    @classmethod
+    def build(cls, image_path, cache_dir, tile_size=TILE_SIZE):
+        image = _read_image(image_path)
+        if image is None:
+            return None
+
+        # level 0, converted strip by strip to bound the extra memory
+        h, w = image.shape[:2]
+        level = np.lib.format.open_memmap(
+            osp.join(cache_dir, "level0.npy"), mode="w+",
+            dtype=np.uint8, shape=(h, w, 4),
+        )
+        for y in range(0, h, STRIP_ROWS):
+            cv2.cvtColor(
+                image[y:y + STRIP_ROWS], cv2.COLOR_BGR2BGRA,
+                dst=level[y:y + STRIP_ROWS],
+            )
+        del image
+        levels = [level]
+
+        while max(h, w) > tile_size:
+            h, w = (h + 1) // 2, (w + 1) // 2
+            level = np.lib.format.open_memmap(
+                osp.join(cache_dir, "level{}.npy".format(len(levels))),
+                mode="w+", dtype=np.uint8, shape=(h, w, 4),
+            )
+            finer = levels[-1]
+            for y in range(0, len(finer), STRIP_ROWS):
+                strip = finer[y:y + STRIP_ROWS]
+                level[y // 2:(y + len(strip) + 1) // 2] = cv2.resize(
+                    np.asarray(strip),
+                    (w, (len(strip) + 1) // 2),
+                    interpolation=cv2.INTER_AREA,
+                )
+            levels.append(level)
+
+        for level in levels:
+            level.flush()
+        np.save(osp.join(cache_dir, "signature.npy"), _signature(image_path))
+        return cls.open(cache_dir, tile_size=tile_size)
+
+    @classmethod
+    def open(cls, cache_dir, tile_size=TILE_SIZE):
+        levels = []
+        while True:
+            path = osp.join(cache_dir, "level{}.npy".format(len(levels)))
+            if not osp.exists(path):
+                break
+            levels.append(np.load(path, mmap_mode="r"))
+        return cls(levels, tile_size=tile_size)
+
+    @classmethod
+    def load(cls, image_path, tile_size=TILE_SIZE):
+        """Open the cached pyramid of ``image_path``, building it if needed.
+
+        Returns ``None`` if the image cannot be decoded.
+        """
+        cache_dir = image_path + PYRAMID_SUFFIX
+        signature_path = osp.join(cache_dir, "signature.npy")
+        if osp.exists(signature_path) and np.array_equal(
+            np.load(signature_path), _signature(image_path)
+        ):
+            return cls.open(cache_dir, tile_size=tile_size)
+        temp_dir = None
+        try:
+            if not osp.exists(cache_dir):
+                os.mkdir(cache_dir)
+            else:
+                # the levels of an older image, more of them maybe, go too
+                stale = glob.glob(osp.join(cache_dir, "level*.npy"))
+                for path in [signature_path] + stale:
+                    if osp.exists(path):
+                        os.remove(path)
+        except OSError:
+            print("Failed to create image pyramid cache: {}".format(cache_dir))
+            cache_dir = temp_dir = tempfile.mkdtemp(prefix="etpyr-")
+        pyramid = cls.build(image_path, cache_dir, tile_size=tile_size)
+        if temp_dir is not None:
+            if pyramid is None:
+                shutil.rmtree(temp_dir, ignore_errors=True)
+            else:
+                pyramid.temp_dir = temp_dir
+        return pyramid
+
+    def close(self):
+        """Release the levels and remove a temporary cache directory."""
+        self.levels = []
+        if self.temp_dir is not None:
+            shutil.rmtree(self.temp_dir, ignore_errors=True)
+            self.temp_dir = None
+
+    def level_for(self, scale):
+        """Coarsest level that still has at least one pixel per screen
+        pixel at ``scale``."""
+        if scale >= 1:
+            return 0
+        level = int(math.floor(math.log(1 / scale, 2)))
+        return min(level, len(self.levels) - 1)
+
+    def tiles(self, level, rect):
+        """Yield the ``(column, row)`` of every tile of ``level``
+        intersecting ``rect`` (a ``QRectF`` in that level's pixels)."""
+        h, w = self.levels[level].shape[:2]
+        t = self.tile_size
+        x0 = max(int(rect.left()) // t, 0)
+        y0 = max(int(rect.top()) // t, 0)
+        x1 = min(int(math.ceil(rect.right())) // t, (w - 1) // t)
+        y1 = min(int(math.ceil(rect.bottom())) // t, (h - 1) // t)
+        for row in range(y0, y1 + 1):
+            for column in range(x0, x1 + 1):
+                yield column, row
+
+    def _qimage(self, array):
+        h, w = array.shape[:2]
+        qimage = QtGui.QImage(w, h, QtGui.QImage.Format_RGB32)
+        bits = qimage.bits()
+        bits.setsize(qimage.bytesPerLine() * h)
+        pixels = np.frombuffer(bits, np.uint8).reshape(h, -1)
+        pixels[:, :w * 4] = array.reshape(h, w * 4)
+        return qimage
+
+    def tile(self, level, column, row):
+        """Tile ``(column, row)`` of ``level`` as a QImage owning its
+        pixels."""
+        t = self.tile_size
+        y, x = row * t, column * t
+        return self._qimage(self.levels[level][y:y + t, x:x + t])
+
+    def overview(self):
+        """The coarsest level as a QImage."""
+        return self._qimage(self.levels[-1])
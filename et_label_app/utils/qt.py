@@ -1,12 +1,12 @@
 from math import sqrt
 import os.path as osp
 
-import numpy as np
-
 from qtpy import QtCore
 from qtpy import QtGui
 from qtpy import QtWidgets
 
+from et_label_app.utils import geometry
+
 
 here = osp.dirname(osp.abspath(__file__))
 
@@ -83,16 +83,9 @@ def distance(p):
 
 def distancetoline(point, line):
     p1, p2 = line
-    p1 = np.array([p1.x(), p1.y()])
-    p2 = np.array([p2.x(), p2.y()])
-    p3 = np.array([point.x(), point.y()])
-    if np.dot((p3 - p1), (p2 - p1)) < 0:
-        return np.linalg.norm(p3 - p1)
-    if np.dot((p3 - p2), (p1 - p2)) < 0:
-        return np.linalg.norm(p3 - p2)
-    if np.linalg.norm(p2 - p1) == 0:
-        return 0
-    return np.linalg.norm(np.cross(p2 - p1, p1 - p3)) / np.linalg.norm(p2 - p1)
+    return geometry.distance_to_segment(
+        (point.x(), point.y()), (p1.x(), p1.y()), (p2.x(), p2.y())
+    )
 
 
 def fmtShortcut(text):
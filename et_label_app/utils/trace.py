@@ -0,0 +1,100 @@
+import threading
+
+import numpy as np
+
+from et_label_app.utils import clock
+
+
+# a gaze chunk's way from the tracker to the screen, all on clock.now()
+STAGES = (
+    "sample",  # tracker timestamp of the chunk's newest sample
+    "pulled",  # GazeThread got it from the inlet
+    "emitted",  # chunk_signal emitted
+    "received",  # Canvas slot entered
+    "processed",  # recorded, fixations and gaze point updated
+    "painted",  # paintEvent that drew the point returned
+)
+
+LATENCY_FILE = "latency.npy"
+
+
+class LatencyTrace(object):
+    """Per-stage timestamps of the last ``capacity`` gaze chunks.
+
+    A chunk is identified by the timestamp of its newest sample, which
+    every stage already has at hand, so tracing does not change what the
+    signals carry. ``mark`` is a dict lookup and an array store, cheap
+    enough to leave on. Stages never reached stay NaN, e.g. ``painted``
+    for chunks superseded by a newer one within the same display frame.
+    """
+
+    def __init__(self, capacity=2 ** 16):
+        self.capacity = capacity
+        self.times = np.full((capacity, len(STAGES)), np.nan)
+        self._rows = {}  # chunk key: row
+        self._keys = [None] * capacity
+        self._next = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return min(self._next, self.capacity)
+
+    def begin(self, key, **stages):
+        """Start tracing the chunk ``key``, with ``stages`` already known."""
+        with self._lock:
+            row = self._next % self.capacity
+            self._next += 1
+            self._rows.pop(self._keys[row], None)
+            self._keys[row] = key
+            self._rows[key] = row
+            self.times[row] = np.nan
+        self.times[row, 0] = key
+        for stage, t in stages.items():
+            self.times[row, STAGES.index(stage)] = t
+
+    def mark(self, key, stage, t=None):
+        row = self._rows.get(key)
+        if row is not None:
+            self.times[row, STAGES.index(stage)] = (
+                clock.now() if t is None else t
+            )
+
+    def clear(self):
+        with self._lock:
+            self._rows.clear()
+            self._keys = [None] * self.capacity
+            self._next = 0
+            self.times[:] = np.nan
+
+    def records(self):
+        """Traced chunks, oldest first, as an (N, len(STAGES)) array."""
+        n = len(self)
+        start = self._next % self.capacity if self._next > n else 0
+        return np.roll(self.times[:n], -start, axis=0)
+
+    def save(self, path):
+        np.save(path, self.records())
+
+
+def latency_stats(records, percentiles=(50, 95, 99)):
+    """Percentiles, in milliseconds, of the time from the sample to each
+    stage and from the previous stage to each stage.
+
+    Returns ``[(stage, count, since_sample, since_previous), ...]`` where
+    both latencies are tuples with one value per percentile.
+    """
+    stats = []
+    for i, stage in enumerate(STAGES[1:], 1):
+        since_sample = (records[:, i] - records[:, 0]) * 1000
+        since_previous = (records[:, i] - records[:, i - 1]) * 1000
+        done = ~np.isnan(since_sample)
+        if not done.any():
+            stats.append((stage, 0, None, None))
+            continue
+        stats.append((
+            stage,
+            int(done.sum()),
+            tuple(np.percentile(since_sample[done], percentiles)),
+            tuple(np.nanpercentile(since_previous[done], percentiles)),
+        ))
+    return stats
@@ -0,0 +1,191 @@
+import bisect
+import math
+
+import numpy as np
+
+
+class _Grid(object):
+    """Square cells of ``size`` units, each listing ids in ascending order.
+
+    Ids are added in ascending order and removed oldest first, so a
+    removed id is always at the head of its cells' lists; the head is
+    skipped by an offset, stored first in each list, and the list is
+    compacted once most of it is dead.
+    """
+
+    __slots__ = ("size", "cells")
+
+    def __init__(self, size):
+        self.size = float(size)
+        self.cells = {}  # (col, row): [offset, id, id, ...]
+
+    def cell(self, x, y):
+        return int(math.floor(x / self.size)), int(math.floor(y / self.size))
+
+    def add(self, cells, i):
+        for cell in cells:
+            self.cells.setdefault(cell, [1]).append(i)
+
+    def remove_oldest(self, cells):
+        for cell in cells:
+            ids = self.cells[cell]
+            ids[0] += 1
+            if ids[0] == len(ids):
+                del self.cells[cell]
+            elif ids[0] > 64 and 2 * ids[0] > len(ids):
+                ids[1:] = ids[ids[0]:]
+                ids[0] = 1
+
+    def query(self, x0, y0, x1, y1, first):
+        """Ids from ``first`` on listed in the cells overlapping the
+        rectangle, ascending and unique."""
+        col0, row0 = self.cell(x0, y0)
+        col1, row1 = self.cell(x1, y1)
+        found = []
+        for col in range(col0, col1 + 1):
+            for row in range(row0, row1 + 1):
+                ids = self.cells.get((col, row))
+                if ids is not None:
+                    found.append(ids[bisect.bisect_left(ids, first, ids[0]):])
+        if not found:
+            return np.empty(0, np.int64)
+        return np.unique(np.concatenate(found).astype(np.int64))
+
+    def clear(self):
+        self.cells.clear()
+
+
+class Trail(object):
+    """The last ``capacity`` vertices of a polyline, with grid indexes of
+    its vertices and segments.
+
+    Vertices are numbered in the order they were added; vertex ``i`` ends
+    segment ``i``, which starts at vertex ``i - 1`` (the first vertex
+    after ``clear`` has a segment of its own, a point). Segments are
+    listed in the ``cell_size`` cells their line runs through and
+    vertices in the cell they fall in, so finding what lies near a point
+    or in a rectangle does not depend on how long the trail has grown.
+    """
+
+    __slots__ = (
+        "capacity", "xy", "begin", "count", "start",
+        "_segments", "_vertices",
+    )
+
+    scan_limit = 256  # queries over fewer segments scan them directly
+
+    def __init__(self, capacity=2 ** 16, cell_size=128):
+        self.capacity = int(capacity)
+        self.xy = np.zeros((self.capacity, 2))  # vertices
+        self.begin = np.zeros((self.capacity, 2))  # starts of the segments
+        self._segments = _Grid(cell_size)
+        self._vertices = _Grid(cell_size)
+        self.count = 0  # vertices ever added
+        self.start = 0  # number of the first vertex since clear
+
+    def __len__(self):
+        return self.count - self.first
+
+    def __getitem__(self, i):
+        """Vertex ``i`` counted from the oldest one kept, or from the
+        newest one if negative, as an (x, y) array."""
+        n = len(self)
+        if not -n <= i < n:
+            raise IndexError("trail index out of range")
+        return self.vertex(self.first + i % n)
+
+    @property
+    def first(self):
+        """Number of the oldest vertex kept."""
+        return max(self.start, self.count - self.capacity)
+
+    def clear(self):
+        self._segments.clear()
+        self._vertices.clear()
+        self.start = self.count
+
+    def append(self, x, y):
+        i = self.count
+        slot = i % self.capacity
+        if i - self.capacity >= self.start:
+            # vertex i - capacity and its segment drop out
+            self._segments.remove_oldest(self._line_cells(slot))
+            self._vertices.remove_oldest(
+                [self._vertices.cell(*self.xy[slot])]
+            )
+        if i > self.start:
+            self.begin[slot] = self.xy[(i - 1) % self.capacity]
+        else:
+            self.begin[slot] = x, y
+        self.xy[slot] = x, y
+        self._segments.add(self._line_cells(slot), i)
+        self._vertices.add([self._vertices.cell(x, y)], i)
+        self.count += 1
+
+    def _line_cells(self, slot):
+        """Cells the segment in ``slot`` runs through."""
+        (x0, y0), (x1, y1) = self.begin[slot], self.xy[slot]
+        grid = self._segments
+        col0, _ = grid.cell(min(x0, x1), 0)
+        col1, _ = grid.cell(max(x0, x1), 0)
+        cells = []
+        for col in range(col0, col1 + 1):
+            # part of the segment within the column
+            xa = max(col * grid.size, min(x0, x1))
+            xb = min((col + 1) * grid.size, max(x0, x1))
+            if x0 == x1:
+                ya, yb = y0, y1
+            else:
+                ya = y0 + (xa - x0) * (y1 - y0) / (x1 - x0)
+                yb = y0 + (xb - x0) * (y1 - y0) / (x1 - x0)
+            _, row0 = grid.cell(0, min(ya, yb))
+            _, row1 = grid.cell(0, max(ya, yb))
+            cells.extend((col, row) for row in range(row0, row1 + 1))
+        return cells
+
+    def vertex(self, i):
+        """Vertex number ``i`` as an (x, y) array."""
+        if not self.first <= i < self.count:
+            raise IndexError("vertex {} is not kept".format(i))
+        return self.xy[i % self.capacity]
+
+    def points(self, first=None):
+        """Vertices from number ``first`` on (all kept by default) as an
+        (N, 2) array, oldest first."""
+        first = self.first if first is None else max(first, self.first)
+        return self.xy[np.arange(first, self.count) % self.capacity]
+
+    def segments(self, ids):
+        """(N, 4) array of x0, y0, x1, y1 of segments ``ids``."""
+        slots = np.asarray(ids, np.int64) % self.capacity
+        return np.hstack([self.begin[slots], self.xy[slots]])
+
+    def segments_in(self, x0, y0, x1, y1, first=None):
+        """Numbers of the segments whose bounding box overlaps the
+        rectangle, ascending, among those ending at vertex ``first`` or
+        later."""
+        first = self.first if first is None else max(first, self.first)
+        if self.count - first <= self.scan_limit:
+            ids = np.arange(first, self.count)
+        else:
+            ids = self._segments.query(x0, y0, x1, y1, first)
+        segments = self.segments(ids)
+        return ids[
+            (np.minimum(segments[:, 0], segments[:, 2]) <= x1)
+            & (np.maximum(segments[:, 0], segments[:, 2]) >= x0)
+            & (np.minimum(segments[:, 1], segments[:, 3]) <= y1)
+            & (np.maximum(segments[:, 1], segments[:, 3]) >= y0)
+        ]
+
+    def nearest(self, x, y, radius, first=None):
+        """Number of the vertex closest to (x, y) within ``radius``, or
+        None."""
+        first = self.first if first is None else max(first, self.first)
+        ids = self._vertices.query(
+            x - radius, y - radius, x + radius, y + radius, first
+        )
+        if not len(ids):
+            return None
+        d = np.hypot(*(self.xy[ids % self.capacity] - (x, y)).T)
+        best = np.argmin(d)
+        return int(ids[best]) if d[best] <= radius else None
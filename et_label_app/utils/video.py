@@ -0,0 +1,190 @@
+import os
+import os.path as osp
+import tempfile
+
+import cv2
+import numpy as np
+
+
+INDEX_SUFFIX = ".etidx.npz"
+# OpenCV's FFmpeg backend seeks this many frames before the target and
+# decodes forward from the preceding key frame
+BACKEND_SEEK_FRAMES = 16
+
+
+class VideoIndex(object):
+    """Presentation time and key-frame positions of every frame of a video.
+
+    The index is built with one demux-only pass (no decoding) and cached
+    next to the video as ``<video>.etidx.npz``; it is rebuilt when the
+    video's size or modification time changes.
+    """
+
+    def __init__(self, timestamps, keyframes, fps):
+        self.timestamps = timestamps  # seconds, one per frame
+        self.keyframes = keyframes  # sorted frame indices
+        self.fps = fps
+
+    def __len__(self):
+        return len(self.timestamps)
+
+    @staticmethod
+    def _signature(video_path):
+        stat = osp.getsize(video_path), osp.getmtime(video_path)
+        return np.array(stat, dtype=np.float64)
+
+    @classmethod
+    def build(cls, video_path):
+        cap = cv2.VideoCapture(video_path, cv2.CAP_FFMPEG)
+        fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+        # raw mode hands out packets without decoding them and reports
+        # key frames; without it every frame is decoded and seeks always
+        # go through the backend
+        raw = hasattr(cv2, "CAP_PROP_LRF_HAS_KEY_FRAME") and cap.set(
+            cv2.CAP_PROP_FORMAT, -1
+        )
+        timestamps = []
+        keyframes = []
+        while cap.grab():
+            if raw and cap.get(cv2.CAP_PROP_LRF_HAS_KEY_FRAME):
+                keyframes.append(len(timestamps))
+            timestamps.append(cap.get(cv2.CAP_PROP_POS_MSEC) / 1000.0)
+        cap.release()
+        if not raw:
+            keyframes = range(len(timestamps))
+        return cls(
+            np.asarray(timestamps, dtype=np.float64),
+            np.asarray(keyframes, dtype=np.int64),
+            fps,
+        )
+
+    @classmethod
+    def estimate(cls, cap):
+        """Provisional index of an open capture from the frame count and
+        rate its container reports. As without raw mode in ``build``,
+        every frame counts as a key frame, so seeks go through the
+        backend."""
+        fps = cap.get(cv2.CAP_PROP_FPS) or 30.0
+        n = max(int(cap.get(cv2.CAP_PROP_FRAME_COUNT)), 0)
+        return cls(
+            np.arange(n, dtype=np.float64) / fps,
+            np.arange(n, dtype=np.int64),
+            fps,
+        )
+
+    @classmethod
+    def cached(cls, video_path):
+        """The index cached next to the video, or None if there is none
+        or it is stale."""
+        index_path = video_path + INDEX_SUFFIX
+        if not osp.exists(index_path):
+            return None
+        with np.load(index_path) as data:
+            if np.array_equal(data["signature"], cls._signature(video_path)):
+                return cls(
+                    data["timestamps"],
+                    data["keyframes"],
+                    float(data["fps"]),
+                )
+        return None
+
+    @classmethod
+    def load(cls, video_path):
+        index = cls.cached(video_path)
+        if index is not None:
+            return index
+        index_path = video_path + INDEX_SUFFIX
+        signature = cls._signature(video_path)
+        index = cls.build(video_path)
+        # written aside and renamed, so that a concurrent load never
+        # reads a partial file
+        try:
+            fd, tmp_path = tempfile.mkstemp(
+                prefix=osp.basename(index_path), dir=osp.dirname(index_path)
+            )
+        except (IOError, OSError):
+            print("Failed to save video index: {}".format(index_path))
+            return index
+        try:
+            with os.fdopen(fd, "wb") as f:
+                np.savez(
+                    f,
+                    signature=signature,
+                    timestamps=index.timestamps,
+                    keyframes=index.keyframes,
+                    fps=index.fps,
+                )
+            os.replace(tmp_path, index_path)
+        except (IOError, OSError):
+            print("Failed to save video index: {}".format(index_path))
+            if osp.exists(tmp_path):
+                os.remove(tmp_path)
+        return index
+
+    def frame_at(self, seconds):
+        """Index of the frame shown at ``seconds`` from the start."""
+        i = np.searchsorted(self.timestamps, seconds, side="right") - 1
+        return int(min(max(i, 0), len(self) - 1))
+
+    def keyframe_before(self, frame_idx):
+        i = np.searchsorted(self.keyframes, frame_idx, side="right") - 1
+        return int(self.keyframes[i]) if i >= 0 else 0
+
+
+class VideoSession(object):
+    """A ``cv2.VideoCapture`` with random access through a ``VideoIndex``.
+
+    ``position`` is the index of the frame the next ``read`` returns.
+    Without ``build_index`` a video that has no cached index yet gets an
+    estimated one instead of being demuxed first, until ``set_index``.
+    """
+
+    def __init__(self, video_path, build_index=True):
+        self.video_path = video_path
+        self.cap = cv2.VideoCapture(video_path)
+        if build_index:
+            index = VideoIndex.load(video_path)
+        else:
+            index = VideoIndex.cached(video_path)
+        self.set_index(index or VideoIndex.estimate(self.cap))
+        self.indexed = index is not None  # False while estimated
+        self.width = int(self.cap.get(cv2.CAP_PROP_FRAME_WIDTH))
+        self.height = int(self.cap.get(cv2.CAP_PROP_FRAME_HEIGHT))
+        self.position = 0
+
+    def set_index(self, index):
+        self.index = index
+        self.indexed = True
+        self.fps = index.fps
+        self.frame_count = len(index)
+
+    def isOpened(self):
+        return self.cap.isOpened()
+
+    def read(self, image=None):
+        ret, image = self.cap.read(image=image)
+        if ret:
+            self.position += 1
+        return ret, image
+
+    def seek(self, frame_idx):
+        frame_idx = int(min(max(frame_idx, 0), max(self.frame_count - 1, 0)))
+        keyframe = self.index.keyframe_before(
+            max(frame_idx - BACKEND_SEEK_FRAMES, 0)
+        )
+        if self.position <= frame_idx and (
+            frame_idx - self.position <= frame_idx - keyframe
+        ):
+            # decoding forward costs fewer frames than a backend seek
+            while self.position < frame_idx and self.cap.grab():
+                self.position += 1
+        else:
+            self.cap.set(cv2.CAP_PROP_POS_FRAMES, frame_idx)
+            self.position = frame_idx
+        return frame_idx
+
+    def seek_time(self, seconds):
+        return self.seek(self.index.frame_at(seconds))
+
+    def release(self):
+        self.cap.release()
@@ -1,13 +1,27 @@
-import copy
+import collections
+import concurrent.futures
+import os.path as osp
+import time
+
+import cv2
+import numpy as np
 
 from qtpy import QtCore
 from qtpy import QtGui
 from qtpy import QtWidgets
 
 from et_label_app import QT5
+import et_label_app.gaze
 import et_label_app.utils
+from et_label_app.analysis.fixation import FixationDetector
+from et_label_app.analysis.heatmap import Heatmap
+from et_label_app.gaze.sources import create_source
 from et_label_app.threads.gaze import GazeThread
+from et_label_app.threads.recorder import RecorderThread
 from et_label_app.threads.video import VideoThread
+from et_label_app.utils import clock
+from et_label_app.utils import geometry
+from et_label_app.utils import trace
 
 
 class Shape(object):
@@ -17,46 +31,44 @@ class Shape(object):
     point_size = 8
     scale = 1.0
 
-    def __init__(self):
-        self.points = []
+    __slots__ = ("points",)
+
+    def __init__(self, points=None):
+        self.points = list(points or [])
 
     def addPoint(self, point):
         self.points.append(point)
-        if len(self.points) == 10:
-            self.points = self.points[1:]
 
     def paint(self, painter):
         if self.points:
-            pen = QtGui.QPen(self.line_color)
-            pen.setWidth(max(1, int(round(2.0 / self.scale))))
-            painter.setPen(pen)
-
-            line_path = QtGui.QPainterPath()
-            vrtx_path = QtGui.QPainterPath()
-
-            line_path.moveTo(self.points[0])
-            for i, p in enumerate(self.points):
-                line_path.lineTo(p)
-                self.drawVertex(vrtx_path, i)
-
-            painter.drawPath(line_path)
-            painter.drawPath(vrtx_path)
-            painter.fillPath(vrtx_path, self._vertex_fill_color)
-
-    def drawVertex(self, path, i):
-        d = self.point_size / self.scale
-        shape = self.point_type
-        point = self.points[i]
-        self._vertex_fill_color = self.vertex_fill_color
-        if shape == "square":
-            path.addRect(point.x() - d / 2, point.y() - d / 2, d, d)
-        elif shape == "round":
-            path.addEllipse(point, d / 2.0, d / 2.0)
-        else:
-            assert False, "unsupported vertex shape"
-
-    def copy(self):
-        return copy.deepcopy(self)
+            xy = np.array([(p.x(), p.y()) for p in self.points])
+            self.paintSegments(
+                painter, np.hstack([xy[:-1], xy[1:]]), xy
+            )
+
+    @classmethod
+    def paintSegments(cls, painter, segments, vertices):
+        """Draw ``segments``, an (N, 4) array of x0, y0, x1, y1, and
+        ``vertices``, an (M, 2) array.
+
+        Segments are stroked one by one: stroking a long self-crossing
+        path as a whole costs time quadratic in its length.
+        """
+        pen = QtGui.QPen(cls.line_color)
+        pen.setWidth(max(1, int(round(2.0 / cls.scale))))
+        painter.setPen(pen)
+        painter.drawLines([QtCore.QLineF(*segment) for segment in segments])
+
+        d = cls.point_size / cls.scale
+        painter.setBrush(cls.vertex_fill_color)
+        for x, y in vertices:
+            if cls.point_type == "square":
+                painter.drawRect(QtCore.QRectF(x - d / 2, y - d / 2, d, d))
+            elif cls.point_type == "round":
+                painter.drawEllipse(QtCore.QPointF(x, y), d / 2.0, d / 2.0)
+            else:
+                assert False, "unsupported vertex shape"
+        painter.setBrush(QtCore.Qt.NoBrush)
 
     def __len__(self):
         return len(self.points)
@@ -72,189 +84,718 @@ class Canvas(QtWidgets.QWidget):
 
     zoomRequest = QtCore.Signal(int, QtCore.QPoint)
     scrollRequest = QtCore.Signal(int, int)
+    # (VideoSession, future of its VideoIndex), from the indexing thread
+    videoIndexed = QtCore.Signal(object, object)
+
+    aoi_color = QtGui.QColor(255, 255, 0, 192)
+
+    max_scaled_pixels = 2 ** 26  # largest zoomed pixmap kept, 256 MiB
+    max_tiles = 128  # pyramid tiles kept as pixmaps
 
     def __init__(self, *args, **kwargs):
+        recording = kwargs.pop("recording", None) or {}
+        gaze = kwargs.pop("gaze", None) or {}
+        video = kwargs.pop("video", None) or {}
+        fixation = kwargs.pop("fixation", None) or {}
+        render = kwargs.pop("render", None) or {}
+        heatmap = kwargs.pop("heatmap", None) or {}
+        aoi = kwargs.pop("aoi", None) or {}
         super(Canvas, self).__init__(*args, **kwargs)
-        self.current = None  # current shape
+        # vertices of the session, the last trail_length are drawn
+        self.current = et_label_app.utils.Trail(
+            render.get("trail_capacity", 2 ** 16)
+        )
+        self.trail_length = render.get("trail_length", 9)  # None: all
         self.line = Shape()  # moving line
         self.scale = 1.0
         self.pixmap = QtGui.QPixmap()
         self._painter = QtGui.QPainter()
+        self._scaled = None  # pixmap at the current zoom
+        self._scaled_key = None  # (pixmap.cacheKey(), scale) of _scaled
+        # large images are shown from an ImagePyramid instead of the pixmap
+        self.pyramid = None
+        self._tiles = collections.OrderedDict()  # (level, col, row): pixmap
 
         self.is_paint = True
         self.is_rec = False
+        self.blank = False  # paint nothing but the background
 
-        self.gaze_thread_timestamp_temp = None
+        screen = QtWidgets.QDesktopWidget().screenGeometry(-1)
+        self.screen_size = np.array([screen.width(), screen.height()], float)
         self.gaze_thread = GazeThread()
+        self.gaze_thread.source = create_source(gaze)
+        self.gaze_thread.batched = gaze.get("batched", True)
+        self.gaze_thread.emit_interval = gaze.get("emit_interval", 1 / 120)
+        # latency of every gaze chunk from tracker to screen
+        self.trace = trace.LatencyTrace() if gaze.get("trace", True) else None
+        self.gaze_thread.trace = self.trace
         self.gaze_thread.point_signal.connect(self.read_gaze_signal)
+        self.gaze_thread.chunk_signal.connect(self.read_gaze_chunk)
         self.gaze_thread.start()
 
         self.content_type = "image"  # image / video
+        self.video_frame = None  # frame currently shown
+        self.video_frame_painted = False
         self.video_thresh = VideoThread()
+        self.video_thresh.prefetch = video.get("prefetch", 8)
         self.video_thresh.video_signal.connect(self.read_video_frame)
         self.video_thresh.start()
-
-    def start_rec(self):
+        self._index_executor = concurrent.futures.ThreadPoolExecutor(1)
+        self.videoIndexed.connect(self.set_video_index)
+
+        self.recorder = RecorderThread(
+            buffer_size=recording.get("buffer_size", 2 ** 18),
+            chunk_size=recording.get("chunk_size", 4096),
+            flush_interval=recording.get("flush_interval", 0.5),
+        )
+
+        # a vertex is committed each time a fixation ends, thresholds are
+        # in screen pixels
+        method = fixation.get("method", "ivt")
+        if method == "ivt":
+            threshold = "velocity_threshold", 1000
+        else:
+            threshold = "dispersion_threshold", 50
+        self.fixation_params = {
+            "method": method,
+            "min_duration": fixation.get("min_duration", 0.1),
+            threshold[0]: fixation.get(*threshold),
+        }
+        self.fixation_detector = FixationDetector(**self.fixation_params)
+
+        # the gaze line follows the latest point once per display frame;
+        # changes only mark a region dirty and the frame timer repaints it
+        self.gaze_pos = None
+        self.gaze_key = None  # trace key of gaze_pos
+        self.paint_key = None  # trace key of the point the next paint draws
+        self.dirty = QtCore.QRect()  # widget coordinates
+        fps = QtWidgets.QApplication.primaryScreen().refreshRate() or 60
+        if render.get("max_fps"):
+            fps = min(fps, render["max_fps"])
+        self.frame_timer = QtCore.QTimer(self)
+        self.frame_timer.setTimerType(QtCore.Qt.PreciseTimer)
+        self.frame_timer.setInterval(int(1000 / fps))
+        self.frame_timer.timeout.connect(self.draw_frame)
+
+        # paint counters, refreshed about once per second
+        self.paint_time = 0.0  # mean seconds per paintEvent
+        self.paints_per_sec = 0.0
+        self._paint_count = 0
+        self._paint_total = 0.0
+        self._paint_window = time.perf_counter()
+
+        # gaze density of the recording, drawn over the image when
+        # show_heatmap
+        self.heatmap_params = {
+            "cell": heatmap.get("cell", 8),
+            "sigma": heatmap.get("sigma", 32),
+        }
+        self.heatmap_weight = heatmap.get("weight", "samples")
+        self.heatmap_alpha = heatmap.get("alpha", 0.6)
+        self.heatmap_interval = heatmap.get("interval", 0.1)
+        self.show_heatmap = heatmap.get("visible", False)
+        self.heatmap = None  # Heatmap of the current recording
+        self._heatmap_image = None  # overlay of _heatmap_version
+        self._heatmap_version = None
+        self._heatmap_time = 0.0
+
+        # AOIs of the stimulus; samples are assigned to them live from a
+        # raster of aoi_cell image pixels
+        self.aois = None
+        self.aoi_mask = None
+        self.aoi_cell = aoi.get("cell", 2)
+        self.show_aois = aoi.get("visible", False)
+        self.aoi_samples = None  # samples on no AOI, then on each
+        self.current_aoi = -1  # AOI of the latest sample
+
+        # latency HUD, toggled with show_hud
+        self.show_hud = False
+        self.hud_text = []
+        self._hud_time = 0.0
+
+    def start_rec(self, session_dir=None, meta=None):
         if self.content_type == "video":
             self.video_thresh.start_video()
+        if session_dir is not None:
+            meta = dict(meta or {})
+            meta.update({
+                "content_type": self.content_type,
+                "image_width": self.imageSize().width(),
+                "image_height": self.imageSize().height(),
+                "screen_width": int(self.screen_size[0]),
+                "screen_height": int(self.screen_size[1]),
+                "started_at": time.time(),
+                # timestamps are pylsl.local_clock(), add wall_offset
+                # for time.time()
+                "clock": "lsl",
+                "wall_offset": clock.measure_offset(clock.now, time.time),
+            })
+            self.recorder.start_session(session_dir, meta)
+            if self.trace is not None:
+                self.trace.clear()
+            size = self.imageSize()
+            self.heatmap = Heatmap(
+                size.width(), size.height(), **self.heatmap_params
+            )
+            self._heatmap_image = self._heatmap_version = None
+        if self.aois is not None:
+            self.aoi_samples = np.zeros(len(self.aois) + 1, np.int64)
+            self.current_aoi = -1
+        self.fixation_detector = FixationDetector(**self.fixation_params)
+        self.frame_timer.start()
         self.is_rec = True
 
+    def stop_rec(self):
+        if self.is_rec:
+            self.frame_timer.stop()
+            self.fixations_ended(self.fixation_detector.flush())
+            if self.show_heatmap:
+                self.update_heatmap(interval=0)  # the final one
+            self.draw_frame()
+        self.is_rec = False
+        if self.recorder.recording and self.trace is not None:
+            self.trace.save(
+                osp.join(self.recorder.session_dir, trace.LATENCY_FILE)
+            )
+        if self.recorder.recording and self.content_type == "video":
+            self.video_thresh.stop_video()
+            frame_times = self.video_thresh.frame_times
+            shown = np.flatnonzero(~np.isnan(frame_times["present"]))
+            et_label_app.gaze.write_frames(
+                self.recorder.session_dir,
+                frame_times[:shown[-1] + 1 if len(shown) else 0],
+            )
+        self.recorder.stop_session()
+
+    def stop_threads(self):
+        self.stop_rec()
+        self.gaze_thread.stop()
+        self.video_thresh.stop()
+        self._index_executor.shutdown(wait=False)
+        self._set_pyramid(None)
+
+    def frame_idx(self):
+        if self.content_type != "video":
+            return -1
+        return self.video_thresh.frame_idx
+
     def load_video(self, video_path):
+        """Hand the video to the video thread and return its first frame.
+
+        A video opened for the first time plays on an estimated index
+        while the real one is built in the background.
+        """
         self.content_type = "video"
-        self.video_thresh.load_video(video_path)
+        session = et_label_app.utils.VideoSession(
+            video_path, build_index=False
+        )
+        if not session.indexed:
+            future = self._index_executor.submit(
+                et_label_app.utils.VideoIndex.load, video_path
+            )
+            future.add_done_callback(
+                lambda f: self.videoIndexed.emit(session, f)
+            )
+        ret, frame = session.read()
+        session.seek(0)
+        self.video_thresh.load_video(session)
+        if not ret:
+            return QtGui.QImage()
+        return et_label_app.utils.img_npy_to_qimage(frame)
+
+    def set_video_index(self, session, future):
+        try:
+            session.set_index(future.result())
+        except Exception as e:
+            print("Failed to index {}: {}".format(session.video_path, e))
 
     def read_video_frame(self, video_signal):
-        self.loadPixmap(video_signal)
+        # the pixmap may share the frame buffer, keep it until replaced
+        self.loadPixmap(QtGui.QPixmap.fromImage(video_signal.image))
+        if self.video_frame is not None:
+            self.video_frame.release()
+        self.video_frame = video_signal
+        self.video_frame_painted = False
+
+    def mark(self, key, stage):
+        if self.trace is not None:
+            self.trace.mark(key, stage)
 
     def read_gaze_signal(self, point_signal):
+        timestamp, point, raw = point_signal
+        self.mark(timestamp, "received")
         if not self.is_rec:
             return
 
-        timestamp, point = point_signal
         pos = self.transformPos(self.mapFromGlobal(point))
 
-        ### save gaze here ###
+        self.recorder.push_sample(
+            timestamp, raw, (pos.x(), pos.y()), self.frame_idx()
+        )
+        if self.heatmap is not None and self.heatmap_weight == "samples":
+            self.heatmap.add(pos.x(), pos.y())
+        if self.aoi_mask is not None:
+            self.current_aoi = self.aoi_mask.hit(pos.x(), pos.y())
+            self.aoi_samples[self.current_aoi + 1] += 1
+        screen = np.asarray(raw) * self.screen_size
+        self.fixations_ended(self.fixation_detector.update(
+            [timestamp], [screen[0]], [screen[1]]
+        ))
+        self.gaze_pos = pos
+        self.gaze_key = timestamp
+        self.mark(timestamp, "processed")
+
+    def read_gaze_chunk(self, samples):
+        key = samples[-1, 0]
+        self.mark(key, "received")
+        if not self.is_rec:
+            return
 
-        if self.is_paint:
-            if self.gaze_thread_timestamp_temp is None:
-                self.gaze_thread_timestamp_temp = [timestamp, timestamp]
-            if timestamp - self.gaze_thread_timestamp_temp[0] > 0.05:
-                self.move_point(pos)
-                self.gaze_thread_timestamp_temp[0] = timestamp
-            if timestamp - self.gaze_thread_timestamp_temp[1] > 1:
-                self.save_point(pos)
-                self.gaze_thread_timestamp_temp[1] = timestamp
+        raw = samples[:, 1:]
+        points = self.transformRaw(raw)
+        self.recorder.push(samples[:, 0], raw, points, self.frame_idx())
+        if self.heatmap is not None and self.heatmap_weight == "samples":
+            self.heatmap.add(points[:, 0], points[:, 1])
+        if self.aoi_mask is not None:
+            hits = self.aoi_mask.assign(points)
+            self.aoi_samples += np.bincount(
+                hits + 1, minlength=len(self.aoi_samples)
+            )
+            self.current_aoi = hits[-1]
+        screen = raw * self.screen_size
+        self.fixations_ended(self.fixation_detector.update(
+            samples[:, 0], screen[:, 0], screen[:, 1]
+        ))
+
+        # draw the latest sample the tracker did not lose
+        valid = np.flatnonzero(~np.isnan(points).any(axis=1))
+        if len(valid):
+            self.gaze_pos = QtCore.QPointF(*points[valid[-1]])
+            self.gaze_key = key
+        self.mark(key, "processed")
+
+    def fixations_ended(self, fixations):
+        if not len(fixations):
+            return
+        centroids = np.stack([fixations["x"], fixations["y"]], axis=1)
+        centroids = self.transformRaw(centroids / self.screen_size)
+        if self.heatmap is not None and self.heatmap_weight == "fixations":
+            self.heatmap.add(
+                centroids[:, 0], centroids[:, 1], fixations["duration"]
+            )
+        if not self.is_paint:
+            return
+        for x, y in centroids:
+            self.save_point(QtCore.QPointF(x, y))
+
+    def draw_frame(self):
+        if self.is_paint and self.gaze_pos is not None:
+            self.move_point(self.gaze_pos)
+            self.gaze_pos = None
+            if not self.dirty.isEmpty():
+                self.paint_key = self.gaze_key
+        if self.show_hud:
+            self.update_hud()
+        if self.show_heatmap:
+            self.update_heatmap()
+        if not self.dirty.isEmpty():
+            self.update(self.dirty)
+            self.dirty = QtCore.QRect()
+
+    def mark_dirty(self, *points):
+        """Schedule a repaint of the area around ``points`` (painter
+        coordinates), done by the next ``draw_frame``."""
+        offset = self.offsetToCenter()
+        xs = [(p.x() + offset.x()) * self.scale for p in points]
+        ys = [(p.y() + offset.y()) * self.scale for p in points]
+        # vertices and pen are drawn at a fixed size on screen
+        margin = Shape.point_size + 2
+        rect = QtCore.QRectF(
+            QtCore.QPointF(min(xs), min(ys)), QtCore.QPointF(max(xs), max(ys))
+        ).adjusted(-margin, -margin, margin, margin)
+        self.dirty = self.dirty.united(rect.toAlignedRect())
+
+    def lastPoint(self):
+        return QtCore.QPointF(*self.current[-1])
+
+    def firstDrawn(self):
+        """Number of the oldest vertex of the trail that is drawn."""
+        if self.trail_length is None:
+            return self.current.first
+        return max(self.current.count - self.trail_length, self.current.first)
 
     def move_point(self, pos):
-        if not self.current:
-            self.repaint()
+        if not len(self.current):
             return
 
+        last = self.lastPoint()
         if self.outOfPixmap(pos):
-            pos = self.intersectionPoint(self.current[-1], pos)
+            pos = self.intersectionPoint(last, pos)
 
-        self.line[0] = self.current[-1]
+        # the trail preview runs from the last vertex through the
+        # previous and the new position
+        self.mark_dirty(last, self.line[1], pos)
+        self.line[0] = last
         self.line[1] = pos
-        self.repaint()
 
     def save_point(self, pos):
-        if self.current:
+        if len(self.current):
             # Add point to existing shape.
-            self.current.addPoint(self.line[1])
-            self.line[0] = self.current[-1]
+            last = self.lastPoint()
+            if self.outOfPixmap(pos):
+                pos = self.intersectionPoint(last, pos)
+            dirty = [last, pos, self.line[1]]
+            first = self.firstDrawn()
+            if self.trail_length is not None and (
+                self.current.count - first >= self.trail_length
+            ):
+                # the oldest vertex drops out of the trail
+                dirty += [
+                    QtCore.QPointF(*self.current.vertex(i))
+                    for i in range(first, min(first + 2, self.current.count))
+                ]
+            self.mark_dirty(*dirty)
+            self.current.append(pos.x(), pos.y())
+            self.line[0] = pos
         elif not self.outOfPixmap(pos):
             # Create new shape.
-            self.current = Shape()
-            self.current.addPoint(pos)
+            self.current.append(pos.x(), pos.y())
             self.line.points = [pos, pos]
-            self.update()
+            self.mark_dirty(pos)
 
     def paintEvent(self, event):
-        if not self.pixmap:
+        if self.blank or (not self.pixmap and self.pyramid is None):
             return super(Canvas, self).paintEvent(event)
 
+        t = time.perf_counter()
         p = self._painter
         p.begin(self)
+
+        # background: a plain blit of the pre-scaled pixmap or tiles,
+        # clipped to the dirty region
+        offset = self.offsetToCenter()
+        scaled = None
+        if self.pyramid is not None:
+            self.paintTiles(p, event.rect())
+        else:
+            scaled = self.scaledPixmap()
+        if scaled is not None:
+            p.drawPixmap((offset * self.scale).toPoint(), scaled)
+
+        # overlays, in painter coordinates
         p.setRenderHint(QtGui.QPainter.Antialiasing)
         p.setRenderHint(QtGui.QPainter.HighQualityAntialiasing)
         p.setRenderHint(QtGui.QPainter.SmoothPixmapTransform)
-
         p.scale(self.scale, self.scale)
-        p.translate(self.offsetToCenter())
+        p.translate(offset)
+
+        if scaled is None and self.pyramid is None:
+            p.drawPixmap(0, 0, self.pixmap)
 
-        p.drawPixmap(0, 0, self.pixmap)
+        if self.show_heatmap and self.heatmap is not None:
+            p.drawImage(self.heatmapRect(), self.heatmapImage())
+        if self.show_aois and self.aois is not None:
+            self.paintAois(p)
 
         Shape.scale = self.scale
-        if self.current:
-            self.current.paint(p)
+        if len(self.current):
+            self.paintTrail(p, event.rect())
             self.line.paint(p)
 
-        if (
-            self.current is not None
-            and len(self.current.points) >= 2
-        ):
-            drawing_shape = self.current.copy()
-            drawing_shape.addPoint(self.line[1])
-            drawing_shape.paint(p)
+        if self.show_hud:
+            self.paint_hud(p)
 
         p.end()
+        self._count_paint(time.perf_counter() - t)
+        if self.paint_key is not None:
+            self.mark(self.paint_key, "painted")
+            self.paint_key = None
+        if self.video_frame is not None and not self.video_frame_painted:
+            self.video_frame_painted = True
+            self.video_thresh.set_frame_time(
+                self.video_frame.index, "display", clock.now()
+            )
+
+    def paintTrail(self, p, rect):
+        """Draw the segments and vertices of the trail that fall within
+        ``rect`` (widget coordinates)."""
+        margin = (Shape.point_size + 2) / self.scale
+        top_left = self.transformPos(QtCore.QPointF(rect.topLeft()))
+        bottom_right = self.transformPos(QtCore.QPointF(rect.bottomRight()))
+        x0, y0 = top_left.x() - margin, top_left.y() - margin
+        x1, y1 = bottom_right.x() + margin, bottom_right.y() + margin
+        first = self.firstDrawn()
+        ids = self.current.segments_in(x0, y0, x1, y1, first)
+        segments = self.current.segments(ids)
+        vertices = segments[:, 2:]
+        inside = (
+            (vertices[:, 0] >= x0) & (vertices[:, 0] <= x1)
+            & (vertices[:, 1] >= y0) & (vertices[:, 1] <= y1)
+        )
+        # the oldest drawn vertex is not joined to the one before
+        Shape.paintSegments(p, segments[ids > first], vertices[inside])
+
+    def paintTiles(self, p, rect):
+        """Blit the pyramid tiles under ``rect`` (widget coordinates),
+        taken from the level closest to the current zoom and resampled
+        once per zoom."""
+        level = self.pyramid.level_for(self.scale)
+        height, width = self.pyramid.levels[level].shape[:2]
+        size = self.pyramid.tile_size
+        s = self.scale * 2 ** level  # widget pixels per level pixel
+        offset = (self.offsetToCenter() * self.scale).toPoint()
+        visible = QtCore.QRectF(
+            (rect.x() - offset.x()) / s, (rect.y() - offset.y()) / s,
+            rect.width() / s, rect.height() / s,
+        )
+        for column, row in self.pyramid.tiles(level, visible):
+            # edges are rounded the same way for neighbouring tiles
+            x0 = int(round(column * size * s))
+            y0 = int(round(row * size * s))
+            key = level, column, row, self.scale
+            tile = self._tiles.pop(key, None)
+            if tile is None:
+                x1 = int(round(min((column + 1) * size, width) * s))
+                y1 = int(round(min((row + 1) * size, height) * s))
+                tile = QtGui.QPixmap.fromImage(
+                    self.pyramid.tile(level, column, row).scaled(
+                        max(x1 - x0, 1), max(y1 - y0, 1),
+                        QtCore.Qt.IgnoreAspectRatio,
+                        QtCore.Qt.SmoothTransformation,
+                    )
+                )
+            self._tiles[key] = tile
+            p.drawPixmap(offset.x() + x0, offset.y() + y0, tile)
+        while len(self._tiles) > self.max_tiles:
+            self._tiles.popitem(last=False)
+
+    def scaledPixmap(self):
+        """The pixmap resampled to the current zoom, or ``None`` when it
+        would be too large to keep and has to be scaled while painting.
+
+        The result is cached until the pixmap or the scale changes.
+        """
+        if self.scale == 1:
+            return self.pixmap
+        key = self.pixmap.cacheKey(), self.scale
+        if key != self._scaled_key:
+            size = self.pixmap.size() * self.scale
+            if size.width() * size.height() > self.max_scaled_pixels:
+                self._scaled = None
+            else:
+                self._scaled = self.pixmap.scaled(
+                    size,
+                    QtCore.Qt.IgnoreAspectRatio,
+                    QtCore.Qt.SmoothTransformation,
+                )
+            self._scaled_key = key
+        return self._scaled
+
+    def setAois(self, aois):
+        """Use ``aois``, an ``AoiSet`` over the image, or None."""
+        self.aois = aois
+        self.aoi_mask = None if aois is None else aois.mask(self.aoi_cell)
+        self.aoi_samples = None
+        if self.is_rec and aois is not None:
+            # counted from now on
+            self.aoi_samples = np.zeros(len(aois) + 1, np.int64)
+        self.current_aoi = -1
+        self.update()
+
+    def trailPolygon(self):
+        """Convex hull of the drawn fixation vertices, as an (N, 2) array,
+        or None with fewer than 3."""
+        points = self.current.points(self.firstDrawn())
+        if len(points) < 3:
+            return None
+        hull = cv2.convexHull(points.astype(np.float32))[:, 0]
+        return hull.astype(float) if len(hull) >= 3 else None
+
+    def paintAois(self, p):
+        pen = QtGui.QPen(self.aoi_color)
+        pen.setWidth(max(1, int(round(2.0 / self.scale))))
+        p.setPen(pen)
+        p.setBrush(QtCore.Qt.NoBrush)
+        font = p.font()
+        font.setPointSizeF(max(font.pointSizeF() / self.scale, 1.0))
+        p.setFont(font)
+        for name, polygon, (x0, y0, _, _) in zip(
+            self.aois.names, self.aois.polygons, self.aois.bboxes
+        ):
+            p.drawPolygon(QtGui.QPolygonF(
+                [QtCore.QPointF(x, y) for x, y in polygon]
+            ))
+            p.drawText(QtCore.QPointF(x0, y0 - 4 / self.scale), name)
+
+    def update_heatmap(self, interval=None):
+        """Rebuild the heatmap overlay and repaint it if the heatmap
+        changed, at most once per ``interval`` seconds,
+        ``heatmap_interval`` by default."""
+        if self.heatmap is None:
+            return
+        if interval is None:
+            interval = self.heatmap_interval
+        now = time.perf_counter()
+        if (
+            self.heatmap.version == self._heatmap_version
+            or now - self._heatmap_time < interval
+        ):
+            return
+        self._heatmap_time = now
+        self._build_heatmap_image()
+        rect = self.heatmapRect().translated(self.offsetToCenter())
+        scaled = QtCore.QRectF(
+            rect.topLeft() * self.scale, rect.bottomRight() * self.scale
+        )
+        self.dirty = self.dirty.united(scaled.toAlignedRect())
+
+    def _build_heatmap_image(self):
+        data = self.heatmap.colorize(self.heatmap_alpha)
+        image = QtGui.QImage(
+            data.data, data.shape[1], data.shape[0], data.strides[0],
+            QtGui.QImage.Format_ARGB32_Premultiplied,
+        )
+        image.ndarray = data
+        self._heatmap_image = image
+        self._heatmap_version = self.heatmap.version
+
+    def heatmapRect(self):
+        """Area covered by the heatmap grid, in painter coordinates."""
+        rows, cols = self.heatmap.grid.shape
+        cell = self.heatmap.cell
+        return QtCore.QRectF(0, 0, cols * cell, rows * cell)
+
+    def heatmapImage(self):
+        """The overlay of the last ``update_heatmap``, a QImage of the
+        grid's size."""
+        if self._heatmap_image is None:
+            self._build_heatmap_image()
+        return self._heatmap_image
+
+    def hudRect(self):
+        visible = self.visibleRegion().boundingRect()
+        lines = len(self.hud_text) + 1
+        return QtCore.QRect(
+            visible.topLeft(),
+            QtCore.QSize(460, self.fontMetrics().height() * lines),
+        )
+
+    def update_hud(self, interval=0.5):
+        """Refresh the HUD text every ``interval`` seconds."""
+        now = time.perf_counter()
+        if now - self._hud_time < interval:
+            return
+        self._hud_time = now
+        lines = ["paint {:.2f} ms, {:.0f}/s".format(
+            self.paint_time * 1000, self.paints_per_sec
+        )]
+        if self.trace is not None:
+            lines.append("latency ms      p50     p95     p99")
+            for stage, count, since_sample, _ in trace.latency_stats(
+                self.trace.records()[-1024:]
+            ):
+                if count:
+                    lines.append("{:<12} {:>7.1f} {:>7.1f} {:>7.1f}".format(
+                        stage, *since_sample
+                    ))
+        if self.aoi_samples is not None:
+            name = "-"
+            if self.current_aoi >= 0:
+                name = self.aois.names[self.current_aoi]
+            share = self.aoi_samples[1:] / max(self.aoi_samples.sum(), 1)
+            lines.append("aoi {}  ({})".format(name, " ".join(
+                "{:.0%}".format(value) for value in share
+            )))
+        self.hud_text = lines
+        self.dirty = self.dirty.united(self.hudRect())
+
+    def paint_hud(self, p):
+        rect = self.hudRect()
+        p.resetTransform()
+        p.fillRect(rect, QtGui.QColor(32, 32, 32))
+        p.setPen(QtGui.QColor(255, 255, 255))
+        p.setFont(QtGui.QFont("monospace"))
+        height = self.fontMetrics().height()
+        for i, line in enumerate(self.hud_text):
+            p.drawText(
+                rect.left() + 6, rect.top() + height * (i + 1), line
+            )
+
+    def _count_paint(self, elapsed):
+        self._paint_count += 1
+        self._paint_total += elapsed
+        window = time.perf_counter() - self._paint_window
+        if window >= 1.0:
+            self.paint_time = self._paint_total / self._paint_count
+            self.paints_per_sec = self._paint_count / window
+            self._paint_count = 0
+            self._paint_total = 0.0
+            self._paint_window += window
 
     def transformPos(self, point):
         """Convert from widget-logical coordinates to painter-logical ones."""
         return point / self.scale - self.offsetToCenter()
 
+    def transformPoints(self, points):
+        """``transformPos`` of an (N, 2) array."""
+        offset = self.offsetToCenter()
+        return geometry.widget_to_image(
+            points, self.scale, (offset.x(), offset.y())
+        )
+
+    def transformRaw(self, raw):
+        """Convert (N, 2) normalized screen coordinates to painter ones."""
+        origin = self.mapToGlobal(QtCore.QPoint(0, 0))
+        return self.transformPoints(
+            raw * self.screen_size - (origin.x(), origin.y())
+        )
+
+    def imageSize(self):
+        if self.pyramid is not None:
+            return self.pyramid.size()
+        return self.pixmap.size()
+
     def offsetToCenter(self):
         s = self.scale
         area = super(Canvas, self).size()
-        w, h = self.pixmap.width() * s, self.pixmap.height() * s
+        size = self.imageSize()
+        w, h = size.width() * s, size.height() * s
         aw, ah = area.width(), area.height()
         x = (aw - w) / (2 * s) if aw > w else 0
         y = (ah - h) / (2 * s) if ah > h else 0
         return QtCore.QPointF(x, y)
 
+    def imageShape(self):
+        size = self.imageSize()
+        return size.width(), size.height()
+
     def outOfPixmap(self, p):
-        w, h = self.pixmap.width(), self.pixmap.height()
+        w, h = self.imageShape()
         return not (0 <= p.x() <= w - 1 and 0 <= p.y() <= h - 1)
 
+    def outOfPixmapMask(self, points):
+        """``outOfPixmap`` of an (N, 2) array."""
+        return geometry.outside(points, self.imageShape())
+
     def intersectionPoint(self, p1, p2):
-        # Cycle through each image edge in clockwise fashion,
-        # and find the one intersecting the current line segment.
-        # http://paulbourke.net/geometry/lineline2d/
-        size = self.pixmap.size()
-        points = [
-            (0, 0),
-            (size.width() - 1, 0),
-            (size.width() - 1, size.height() - 1),
-            (0, size.height() - 1),
-        ]
-        # x1, y1 should be in the pixmap, x2, y2 should be out of the pixmap
-        x1 = min(max(p1.x(), 0), size.width() - 1)
-        y1 = min(max(p1.y(), 0), size.height() - 1)
-        x2, y2 = p2.x(), p2.y()
-        d, i, (x, y) = min(self.intersectingEdges((x1, y1), (x2, y2), points))
-        x3, y3 = points[i]
-        x4, y4 = points[(i + 1) % 4]
-        if (x, y) == (x1, y1):
-            # Handle cases where previous point is on one of the edges.
-            if x3 == x4:
-                return QtCore.QPointF(x3, min(max(0, y2), max(y3, y4)))
-            else:  # y3 == y4
-                return QtCore.QPointF(min(max(0, x2), max(x3, x4)), y3)
+        """Where the line from ``p1`` (in the pixmap) to ``p2`` (out of
+        it) leaves the pixmap."""
+        x, y = geometry.clip_segment(
+            (p1.x(), p1.y()), (p2.x(), p2.y()), self.imageShape()
+        )
         return QtCore.QPointF(x, y)
 
-    def intersectingEdges(self, point1, point2, points):
-        """Find intersecting edges.
-
-        For each edge formed by `points', yield the intersection
-        with the line segment `(x1,y1) - (x2,y2)`, if it exists.
-        Also return the distance of `(x2,y2)' to the middle of the
-        edge along with its index, so that the one closest can be chosen.
-        """
-        (x1, y1) = point1
-        (x2, y2) = point2
-        for i in range(4):
-            x3, y3 = points[i]
-            x4, y4 = points[(i + 1) % 4]
-            denom = (y4 - y3) * (x2 - x1) - (x4 - x3) * (y2 - y1)
-            nua = (x4 - x3) * (y1 - y3) - (y4 - y3) * (x1 - x3)
-            nub = (x2 - x1) * (y1 - y3) - (y2 - y1) * (x1 - x3)
-            if denom == 0:
-                continue
-            ua, ub = nua / denom, nub / denom
-            if 0 <= ua <= 1 and 0 <= ub <= 1:
-                x = x1 + ua * (x2 - x1)
-                y = y1 + ua * (y2 - y1)
-                m = QtCore.QPointF((x3 + x4) / 2, (y3 + y4) / 2)
-                d = et_label_app.utils.distance(m - QtCore.QPointF(x2, y2))
-                yield d, i, (x, y)
+    def intersectionPoints(self, p1, p2):
+        """``intersectionPoint`` of (N, 2) arrays."""
+        return geometry.clip_segments(p1, p2, self.imageShape())
 
     # These two, along with a call to adjustSize are required for the scroll area.
     def sizeHint(self):
         return self.minimumSizeHint()
 
     def minimumSizeHint(self):
-        if self.pixmap:
-            return self.scale * self.pixmap.size()
+        if self.pixmap or self.pyramid is not None:
+            return self.scale * self.imageSize()
         return super(Canvas, self).minimumSizeHint()
 
     def wheelEvent(self, ev):
@@ -284,10 +825,30 @@ class Canvas(QtWidgets.QWidget):
                 self.scrollRequest.emit(ev.delta(), QtCore.Qt.Horizontal)
         ev.accept()
 
+    def _set_pyramid(self, pyramid):
+        if self.pyramid is not None and self.pyramid is not pyramid:
+            self.pyramid.close()
+        self.pyramid = pyramid
+        self._tiles.clear()
+
     def loadPixmap(self, pixmap):
         self.pixmap = pixmap
+        self._set_pyramid(None)
+        self.update()
+
+    def loadPyramid(self, pyramid):
+        """Show an ``ImagePyramid`` instead of a pixmap."""
+        self.pixmap = QtGui.QPixmap()
+        self._set_pyramid(pyramid)
         self.update()
 
     def resetState(self):
+        self.current.clear()
+        self.line = Shape()
         self.pixmap = None
+        self._set_pyramid(None)
+        self._scaled = self._scaled_key = None
+        self.content_type = "image"
+        self.aois = self.aoi_mask = self.aoi_samples = None
+        self.heatmap = self._heatmap_image = self._heatmap_version = None
         self.update()